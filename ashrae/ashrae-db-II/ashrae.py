@@ -1,23 +1,134 @@
+import hashlib
+import json
+import os
+
 import pandas as pd
 import numpy as np
 
-def merge_metadata_with_measurements(measurements_path, metadata_path):
+from db_loader import TEXT_COLUMNS, concat_chunks, read_db_csv, with_float_flags
+
+try:
+    import pyarrow  # Optional: typed columnar copy of the LLM dataset
+except ImportError:
+    pyarrow = None
+
+# Everything that shapes measurements.csv besides the input files; all of it is
+# part of the fingerprint, so changing any of it triggers a full rebuild
+PIPELINE_VERSION = 2  # bump when the processing steps change
+READ_CHUNK_ROWS = 20000  # rows parsed at a time when loading the inputs
+RANDOM_STATE = 42  # shuffle of the full build and of appended records
+FILTER_RULES = {
+    'required': ['ta', 'pmv', 'rh'],  # rows missing any of these are dropped
+    'required_any': [['t_out_isd', 't_out']],  # at least one of each group
+}
+
+def file_fingerprint(path, previous=None):
     """
-    Merge metadata with measurements (in-memory only, no file saved).
-    
+    Fingerprint an input file by size, mtime and content hash.
+
+    The content is only hashed again when size or mtime differ from the
+    previous fingerprint, so checking unchanged inputs costs two stat calls.
+
+    Args:
+        path (str): File to fingerprint
+        previous (dict): Fingerprint of the same file from the last run
+
+    Returns:
+        dict: size, mtime_ns and sha256 of the file
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and all(previous.get(key) == value for key, value in fingerprint.items()):
+        fingerprint['sha256'] = previous['sha256']
+        return fingerprint
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+def output_fingerprint(path):
+    """Size and mtime of the written dataset, to notice edits made outside the pipeline"""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def params_fingerprint():
+    """Hash of everything besides the inputs that shapes the output"""
+    params = {
+        'version': PIPELINE_VERSION,
+        'filter_rules': FILTER_RULES,
+        'random_state': RANDOM_STATE,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+def building_fingerprints(df_measurements, df_metadata):
+    """
+    Hash the measurement rows and the metadata row of every building.
+
+    Args:
+        df_measurements (pd.DataFrame): Raw measurements
+        df_metadata (pd.DataFrame): Raw metadata
+
+    Returns:
+        dict: building_id (as str) -> hex digest
+    """
+    measurement_hashes = pd.util.hash_pandas_object(df_measurements, index=False).to_numpy()
+    metadata_hashes = pd.util.hash_pandas_object(df_metadata, index=False).to_numpy()
+    metadata_rows = df_metadata.groupby('building_id', sort=False).indices
+    no_rows = np.array([], dtype=int)
+
+    fingerprints = {}
+    for building_id, rows in df_measurements.groupby('building_id', sort=False).indices.items():
+        digest = hashlib.sha1(measurement_hashes[rows].tobytes())
+        digest.update(metadata_hashes[metadata_rows.get(building_id, no_rows)].tobytes())
+        fingerprints[str(building_id)] = digest.hexdigest()
+    return fingerprints
+
+def load_manifest(manifest_path):
+    """Fingerprints recorded by the last run, or {} if there is none"""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def save_manifest(manifest_path, manifest):
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def load_inputs(measurements_path, metadata_path):
+    """
+    Load the raw measurements and metadata.
+
     Args:
-        measurements_path (str): Path to db_measurements_v2.1.0.csv
+        measurements_path (str): Path to db_measurements_v2.1.0.csv(.gz)
         metadata_path (str): Path to db_metadata.csv
-    
+
     Returns:
-        pd.DataFrame: Merged dataset (measurements + metadata) in memory
+        tuple: (measurements, metadata) DataFrames
     """
-    print("=== Step 1: Loading Input Datasets ===")
-    df_measurements = pd.read_csv(measurements_path, low_memory=False)
-    df_metadata = pd.read_csv(metadata_path)
+    print("\n=== Step 1: Loading Input Datasets ===")
+    # Typed schema (categoricals, Int8 flags) read in chunks to bound the parser's
+    # memory; floats stay float64 so the values written out are unchanged
+    df_measurements = concat_chunks(
+        read_db_csv(measurements_path, chunksize=READ_CHUNK_ROWS, float_dtype='float64')
+    )
+    df_metadata = read_db_csv(metadata_path, float_dtype='float64')
     print(f"   - Measurements: {df_measurements.shape[0]} rows, {df_measurements.shape[1]} columns")
     print(f"   - Metadata: {df_metadata.shape[0]} rows, {df_metadata.shape[1]} columns")
+    return df_measurements, df_metadata
 
+def merge_metadata_with_measurements(df_measurements, df_metadata):
+    """
+    Merge metadata with measurements (in-memory only, no file saved).
+    
+    Args:
+        df_measurements (pd.DataFrame): Measurements (all or only the affected buildings)
+        df_metadata (pd.DataFrame): Metadata
+    
+    Returns:
+        pd.DataFrame: Merged dataset (measurements + metadata) in memory
+    """
     print("\n=== Step 2: Verifying Building ID Consistency ===")
     unique_meas_buildings = df_measurements['building_id'].nunique()
     unique_meta_buildings = df_metadata['building_id'].nunique()
@@ -39,24 +150,23 @@ def merge_metadata_with_measurements(measurements_path, metadata_path):
     print(f"   - Columns added from metadata: {df_merged.shape[1] - df_measurements.shape[1]}")
     return df_merged
 
-def process_measurements_for_llm(df_merged, llm_output_path):
+def process_measurements_for_llm(df_merged):
     """
-    Process merged data into LLM-ready format and save final file.
+    Filter merged data by FILTER_RULES and derive the LLM columns.
     
     Args:
         df_merged (pd.DataFrame): In-memory merged dataset
-        llm_output_path (str): Path to save measurements.csv
     
     Returns:
-        pd.DataFrame: LLM-ready dataset
+        pd.DataFrame: LLM-ready rows, not yet shuffled
     """
     print("\n=== Step 4: Filtering Critical Data for LLM ===")
-    df_llm = df_merged.loc[
-        (~df_merged['ta'].isna()) &
-        (~df_merged['pmv'].isna()) &
-        (~df_merged['rh'].isna()) &
-        (~df_merged['t_out_isd'].isna() | ~df_merged['t_out'].isna())
-    ].copy()
+    keep = pd.Series(True, index=df_merged.index)
+    for col in FILTER_RULES['required']:
+        keep &= df_merged[col].notna()
+    for cols in FILTER_RULES['required_any']:
+        keep &= df_merged[cols].notna().any(axis=1)
+    df_llm = df_merged.loc[keep].copy()
 
     # Calculate retention metrics
     initial_rows = len(df_merged)
@@ -64,8 +174,8 @@ def process_measurements_for_llm(df_merged, llm_output_path):
     filtered_rows = len(df_llm)
     filtered_buildings = len(df_llm['building_id'].unique())
     
-    print(f"   - Rows: {initial_rows} → {filtered_rows} (retention: {round((filtered_rows/initial_rows)*100,2)}%)")
-    print(f"   - Buildings: {initial_buildings} → {filtered_buildings} (retention: {round((filtered_buildings/initial_buildings)*100,2)}%)")
+    print(f"   - Rows: {initial_rows} → {filtered_rows} (retention: {round((filtered_rows/max(initial_rows, 1))*100,2)}%)")
+    print(f"   - Buildings: {initial_buildings} → {filtered_buildings} (retention: {round((filtered_buildings/max(initial_buildings, 1))*100,2)}%)")
 
     print("\n=== Step 5: Creating Unified Outdoor Temperature ===")
     df_llm['t_out_combined'] = df_llm['t_out_isd'].fillna(df_llm['t_out'])
@@ -74,32 +184,183 @@ def process_measurements_for_llm(df_merged, llm_output_path):
     print("\n=== Step 6: Removing Redundant Columns ===")
     df_llm = df_llm.drop(columns=['t_out_isd', 't_out'])
     print("   - Removed: ['t_out_isd', 't_out'] | Added: ['t_out_combined']")
+    return df_llm
+
+def update_llm_dataset(df_previous, df_rebuilt, affected):
+    """
+    Replace the rows of the affected buildings in the previous dataset.
+
+    Records that were already in the dataset keep their position (with the
+    rebuilt values), records of removed buildings are dropped and new records
+    are shuffled and appended, so the first N records stay the same as more
+    buildings are added.
+
+    Args:
+        df_previous (pd.DataFrame): Dataset written by the last run
+        df_rebuilt (pd.DataFrame): Processed rows of the affected buildings
+        affected (set): building_ids (as str) that are new, changed or removed
+
+    Returns:
+        pd.DataFrame: Updated LLM-ready dataset
+    """
+    position = pd.Series(np.arange(len(df_previous)), index=df_previous['record_id'])
+    kept = df_previous[~df_previous['building_id'].astype(str).isin(affected)]
+    known = df_rebuilt['record_id'].isin(position.index)
+
+    df_existing = pd.concat([kept, df_rebuilt[known]])
+    order = np.argsort(position[df_existing['record_id']].to_numpy(), kind='stable')
+    df_added = df_rebuilt[~known].sample(frac=1, random_state=RANDOM_STATE)
+    df_llm = pd.concat([df_existing.iloc[order], df_added], ignore_index=True)
+    print(f"   - Kept {len(kept)} rows, updated {int(known.sum())}, "
+          f"appended {len(df_added)}, dropped {len(df_previous) - len(df_existing)}")
+    return df_llm
+
+def save_llm_dataset(df_llm, llm_output_path):
+    """
+    Save the LLM dataset as CSV and as a typed columnar copy.
 
-    print("\n=== Step 7: Saving Final LLM Dataset ===")
-    # shuffle the database
-    df_llm = df_llm.sample(frac=1, random_state=42).reset_index(drop=True)
+    Args:
+        df_llm (pd.DataFrame): LLM-ready dataset
+        llm_output_path (str): Path to save measurements.csv
+    """
+    df_llm = with_float_flags(df_llm)
     df_llm.to_csv(llm_output_path, index=False)
     print(f"   - ✓ Saved to: {llm_output_path}")
+    columnar_output_path = write_columnar(df_llm, llm_output_path)
+    if columnar_output_path:
+        print(f"   - ✓ Typed columnar copy saved to: {columnar_output_path}")
+    else:
+        print("   - pyarrow not installed, skipped the typed columnar copy")
 
     # Final summary
     print("\n=== Final Dataset Summary ===")
     print(f"Total Rows: {len(df_llm)} | Columns: {len(df_llm.columns)}")
     print(f"Key Columns: 'ta', 'thermal_sensation', 'rh', 't_out_combined', 'building_id', 'country'")
 
+def build_llm_dataset(measurements_path, metadata_path, llm_output_path):
+    """
+    Build measurements.csv, redoing only what changed since the last run.
+
+    The inputs, FILTER_RULES, RANDOM_STATE and PIPELINE_VERSION are
+    fingerprinted in a manifest next to the output. If nothing changed the
+    run stops after the fingerprint check; if only some buildings changed,
+    only their rows are merged and processed (see update_llm_dataset).
+    Anything else (first run, new parameters, output edited by hand) is a
+    full rebuild shuffled with RANDOM_STATE.
+
+    Args:
+        measurements_path (str): Path to db_measurements_v2.1.0.csv(.gz)
+        metadata_path (str): Path to db_metadata.csv
+        llm_output_path (str): Path to save measurements.csv
+
+    Returns:
+        pd.DataFrame: LLM-ready dataset, or None if it was already up to date
+    """
+    manifest_path = os.path.splitext(llm_output_path)[0] + '.manifest.json'
+    manifest = load_manifest(manifest_path)
+    previous_inputs = manifest.get('inputs', {})
+
+    print("=== Step 0: Checking Fingerprints ===")
+    params = params_fingerprint()
+    inputs = {
+        'measurements': file_fingerprint(measurements_path, previous_inputs.get('measurements')),
+        'metadata': file_fingerprint(metadata_path, previous_inputs.get('metadata')),
+    }
+    incremental = (
+        manifest.get('params') == params
+        and os.path.exists(llm_output_path)
+        and manifest.get('output') == output_fingerprint(llm_output_path)
+    )
+    unchanged = all(
+        inputs[name]['sha256'] == previous_inputs.get(name, {}).get('sha256') for name in inputs
+    )
+    if incremental and unchanged:
+        manifest['inputs'] = inputs  # a touched but identical input is not hashed again
+        save_manifest(manifest_path, manifest)
+        print(f"   - ✓ Inputs and parameters unchanged, {llm_output_path} is up to date")
+        return None
+
+    df_measurements, df_metadata = load_inputs(measurements_path, metadata_path)
+    buildings = building_fingerprints(df_measurements, df_metadata)
+
+    if not incremental:
+        print("\n   - Full rebuild (first run, new parameters or output changed outside the pipeline)")
+        df_merged = merge_metadata_with_measurements(df_measurements, df_metadata)
+        df_llm = process_measurements_for_llm(df_merged)
+        print("\n=== Step 7: Saving Final LLM Dataset ===")
+        # shuffle the database
+        df_llm = df_llm.sample(frac=1, random_state=RANDOM_STATE).reset_index(drop=True)
+    else:
+        previous_buildings = manifest['buildings']
+        affected = {
+            building_id for building_id in set(buildings) | set(previous_buildings)
+            if buildings.get(building_id) != previous_buildings.get(building_id)
+        }
+        print(f"\n   - {len(affected)} buildings new, changed or removed since the last run")
+        if affected:
+            is_affected = df_measurements['building_id'].astype(str).isin(affected)
+            df_merged = merge_metadata_with_measurements(df_measurements[is_affected], df_metadata)
+            df_rebuilt = process_measurements_for_llm(df_merged)
+            # Parse the kept rows with the dtypes of the raw inputs (as in a full
+            # build) rather than whatever read_csv infers from the output alone
+            dtypes = {
+                col: 'category' if isinstance(dtype, pd.CategoricalDtype) else dtype
+                for col, dtype in df_rebuilt.dtypes.items()
+            }
+            df_previous = pd.read_csv(llm_output_path, dtype=dtypes)
+            print("\n=== Step 7: Saving Final LLM Dataset ===")
+            df_llm = update_llm_dataset(df_previous, df_rebuilt, affected)
+        else:
+            df_llm = None  # e.g. metadata of buildings without measurements changed
+
+    if df_llm is not None:
+        save_llm_dataset(df_llm, llm_output_path)
+    else:
+        print(f"   - ✓ No building changed, {llm_output_path} is up to date")
+    save_manifest(manifest_path, {
+        'params': params,
+        'inputs': inputs,
+        'output': output_fingerprint(llm_output_path),
+        'buildings': buildings,
+    })
     return df_llm
 
+def write_columnar(df_llm, llm_output_path):
+    """
+    Save a typed columnar copy of the LLM dataset next to the CSV.
+
+    The copy is an uncompressed Feather (Arrow IPC) file, so the evaluation
+    scripts can memory-map it and read only the columns they need, with
+    the text columns (TEXT_COLUMNS of db_loader) stored as categories.
+
+    Args:
+        df_llm (pd.DataFrame): LLM-ready dataset, in the row order of the CSV
+        llm_output_path (str): Path of measurements.csv
+
+    Returns:
+        str: Path of measurements.feather, or None if pyarrow is not installed
+    """
+    if pyarrow is None:
+        return None
+    df_typed = df_llm.copy()
+    for col in TEXT_COLUMNS:
+        if col in df_typed.columns and not pd.api.types.is_numeric_dtype(df_typed[col]):
+            df_typed[col] = df_typed[col].astype('category')
+    columnar_output_path = os.path.splitext(llm_output_path)[0] + '.feather'
+    df_typed.to_feather(columnar_output_path, compression='uncompressed')
+    return columnar_output_path
+
 # Main execution
 if __name__ == "__main__":
     # Define file paths
-    MEASUREMENTS_PATH = "./v2.1.0/db_measurements_v2.1.0.csv"
+    MEASUREMENTS_PATH = "./v2.1.0/db_measurements_v2.1.0.csv.gz"
     METADATA_PATH = "./v2.1.0/db_metadata.csv"
     LLM_OUTPUT_PATH = "measurements.csv"
 
-    # Run pipeline
-    merged_data = merge_metadata_with_measurements(MEASUREMENTS_PATH, METADATA_PATH)
-    llm_data = process_measurements_for_llm(merged_data, LLM_OUTPUT_PATH)
+    # Run pipeline (incremental, see build_llm_dataset)
+    build_llm_dataset(MEASUREMENTS_PATH, METADATA_PATH, LLM_OUTPUT_PATH)
 
     # Show sample
     print("\n=== Sample of Final Data (First 3 Rows) ===")
     sample_cols = ['record_id', 'building_id', 'ta', 'rh', 'pmv', 't_out_combined', 'country', 'climate']
-    print(llm_data[sample_cols].head(3))
\ No newline at end of file
+    print(pd.read_csv(LLM_OUTPUT_PATH, usecols=sample_cols, nrows=3)[sample_cols])
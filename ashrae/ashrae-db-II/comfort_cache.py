@@ -0,0 +1,200 @@
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pythermalcomfort
+from pythermalcomfort.models import pmv_ppd, set_tmp
+from pythermalcomfort.utilities import clo_dynamic, v_relative
+
+# ===================== Inputs and Outputs =====================
+# Measured inputs that determine every index; vel_r and clo_d derive from them
+COMFORT_INPUTS = ["ta", "tr", "vel", "rh", "met", "clo"]
+COMFORT_OUTPUTS = ["set", "pmv_ce", "ppd_ce", "pmv", "ppd"]
+
+# Decimals the inputs are rounded to with quantize=True, about the resolution
+# the DB II contributors recorded them with
+SENSOR_DECIMALS = {"ta": 1, "tr": 1, "vel": 2, "rh": 0, "met": 2, "clo": 2}
+
+# Bump when comfort_indices changes, so cached results are not reused
+CACHE_VERSION = 1
+
+# A row whose ASHRAE cooling effect is a float (3.79), see comfort_indices
+_LEAD_ROW = {"ta": 30.0, "tr": 30.0, "vel": 0.8, "rh": 50.0, "met": 1.2, "clo": 0.5}
+
+
+def comfort_indices(df):
+    """SET, PMV and PPD (ASHRAE 55 as pmv_ce/ppd_ce, ISO 7730 as pmv/ppd) of
+    each row of df, from its COMFORT_INPUTS, with the same index
+
+    pmv_ppd(standard="ashrae") maps cooling_effect with np.vectorize, which
+    takes its output dtype from the first row: when cooling_effect gives up
+    on that row it returns the int 0 and every cooling effect in the call is
+    truncated to an integer. The rows are computed behind _LEAD_ROW, so the
+    result of a row does not depend on the rows it is computed with.
+    """
+    inputs = pd.concat(
+        [pd.DataFrame([_LEAD_ROW]), df[COMFORT_INPUTS]], ignore_index=True
+    )
+    # relative air speed and dynamic clothing
+    vel_r = v_relative(v=inputs["vel"], met=inputs["met"])
+    clo_d = clo_dynamic(clo=inputs["clo"], met=inputs["met"])
+
+    indices = pd.DataFrame(index=inputs.index)
+    indices["set"] = set_tmp(
+        tdb=inputs["ta"],
+        tr=inputs["tr"],
+        v=inputs["vel"],
+        rh=inputs["rh"],
+        met=inputs["met"],
+        clo=inputs["clo"],
+    )
+    for standard, pmv, ppd in (("ashrae", "pmv_ce", "ppd_ce"), ("iso", "pmv", "ppd")):
+        results = pmv_ppd(
+            tdb=inputs["ta"],
+            tr=inputs["tr"],
+            vr=vel_r,
+            rh=inputs["rh"],
+            met=inputs["met"],
+            clo=clo_d,
+            wme=0,
+            standard=standard,
+        )
+        indices[pmv] = results["pmv"]
+        indices[ppd] = results["ppd"]
+    return indices.iloc[1:].set_axis(df.index)
+
+
+# ===================== Memoized Evaluation =====================
+class ComfortCache:
+    """Persistent cache of comfort indices, keyed by the input tuple
+
+    indices() computes each distinct tuple of COMFORT_INPUTS once and only if
+    it is not cached yet, then scatters the results back to the rows. The
+    cache is an SQLite file (":memory:" for one that lasts the process);
+    results are stored with the pythermalcomfort version that computed them,
+    so an upgrade recomputes everything instead of mixing the two, and as
+    the bytes of the float64 values, since SQLite REAL turns -0.0 into 0
+    and NaN into NULL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.version = f"{pythermalcomfort.__version__}/{CACHE_VERSION}"
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{col} REAL NOT NULL" for col in COMFORT_INPUTS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS indices (version TEXT NOT NULL, {columns}, "
+            f"outputs BLOB NOT NULL, PRIMARY KEY (version, {', '.join(COMFORT_INPUTS)}))"
+        )
+        self.conn.commit()
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, unique):
+        """Cached outputs of the distinct input tuples in unique"""
+        columns = ", ".join(COMFORT_INPUTS)
+        self.conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS wanted ({columns})")
+        self.conn.execute("DELETE FROM wanted")
+        self.conn.executemany(
+            f"INSERT INTO wanted VALUES ({', '.join('?' * len(COMFORT_INPUTS))})",
+            unique.itertuples(index=False),
+        )
+        rows = self.conn.execute(
+            f"SELECT {columns}, outputs "
+            f"FROM wanted JOIN indices USING ({columns}) WHERE version = ?",
+            (self.version,),
+        ).fetchall()
+        cached = pd.DataFrame(
+            [row[:-1] for row in rows], columns=COMFORT_INPUTS, dtype=float
+        )
+        outputs = np.frombuffer(b"".join(row[-1] for row in rows), dtype=np.float64)
+        cached[COMFORT_OUTPUTS] = outputs.reshape(len(rows), len(COMFORT_OUTPUTS))
+        return cached
+
+    def _store(self, unique, computed):
+        outputs = computed[COMFORT_OUTPUTS].to_numpy(np.float64)
+        placeholders = ", ".join("?" * (len(COMFORT_INPUTS) + 2))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO indices VALUES ({placeholders})",
+            (
+                (self.version, *inputs, values.tobytes())
+                for inputs, values in zip(unique.itertuples(index=False), outputs)
+            ),
+        )
+        self.conn.commit()
+
+    def indices(self, df, quantize=False, compute=comfort_indices):
+        """comfort_indices of df, each distinct input tuple computed once
+
+        With quantize, the inputs are rounded to SENSOR_DECIMALS first, so
+        rows that differ by less than the sensors can resolve share a result.
+        compute is called on the tuples that are not cached yet; it can be
+        anything with the signature of comfort_indices, e.g. a parallel
+        version of it. Rows with a missing input get NaN.
+        """
+        inputs = df[COMFORT_INPUTS].astype(float)
+        if quantize:
+            inputs = inputs.round(SENSOR_DECIMALS)
+        complete = inputs.notna().all(axis=1).to_numpy()
+        inputs = inputs[complete]
+
+        # number the distinct tuples and keep the first row of each
+        codes = inputs.groupby(COMFORT_INPUTS, sort=False).ngroup().to_numpy()
+        _, first = np.unique(codes, return_index=True)
+        unique = inputs.iloc[first].reset_index(drop=True)
+
+        values = unique.merge(
+            self._lookup(unique), on=COMFORT_INPUTS, how="left", indicator=True
+        )
+        missing = (values["_merge"] == "left_only").to_numpy()
+        if missing.any():
+            computed = compute(unique[missing])[COMFORT_OUTPUTS]
+            values.loc[missing, COMFORT_OUTPUTS] = computed.to_numpy()
+            self._store(unique[missing], computed)
+        self.rows += len(df)
+        self.hits += int((~missing).sum())
+        self.misses += int(missing.sum())
+
+        scattered = np.full((len(df), len(COMFORT_OUTPUTS)), np.nan)
+        scattered[complete] = values[COMFORT_OUTPUTS].to_numpy()[codes]
+        return pd.DataFrame(scattered, index=df.index, columns=COMFORT_OUTPUTS)
+
+    def report(self):
+        """Print how much work the deduplication and the cache saved"""
+        tuples = self.hits + self.misses
+        hit_rate = self.hits / tuples if tuples else 0.0
+        print("\n=== Comfort Cache Summary ===")
+        print(f"   - Rows: {self.rows} | Distinct input tuples: {tuples}")
+        print(
+            f"   - Cached: {self.hits} | Computed: {self.misses} "
+            f"| Hit rate: {hit_rate:.2%}"
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+# ===================== Scoring Clothing Values =====================
+def score_clothing(df, clo, cache=None):
+    """PMV (ISO 7730) of each row of df with its measured clothing and with
+    clo instead (e.g. values suggested by an LLM), and their difference
+
+    Both are pythermalcomfort evaluations through the cache, so scoring many
+    suggestions for the same rows only computes the new tuples.
+    """
+    cache = cache or ComfortCache(":memory:")
+    measured = cache.indices(df)["pmv"]
+    suggested = cache.indices(df.assign(clo=np.asarray(clo, dtype=float)))["pmv"]
+    return pd.DataFrame(
+        {
+            "pmv": measured,
+            "pmv_suggested": suggested,
+            "pmv_error": suggested - measured,
+        }
+    )
@@ -0,0 +1,201 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# ===================== Schema of the DB II Files =====================
+# Keys and counts, never missing
+INT_COLUMNS = {
+    "index": "int32",
+    "record_id": "int32",
+    "building_id": "int32",
+    "year": "int16",
+    "records": "int32",
+}
+
+# 0/1 flags (environmental controls), missing where not recorded
+FLAG_COLUMNS = ["blind_curtain", "fan", "window", "door", "heater"]
+
+# Text columns; the few distinct values per column are stored once
+TEXT_COLUMNS = [
+    # Measurements
+    "timestamp",
+    "season",
+    "subject_id",
+    "gender",
+    "thermal_acceptability",
+    "thermal_preference",
+    "air_movement_acceptability",
+    "air_movement_preference",
+    # Metadata
+    "building_id_inf",
+    "contributor",
+    "publication",
+    "region",
+    "country",
+    "city",
+    "climate",
+    "building_type",
+    "cooling_type",
+    "has_age",
+    "has_ec",
+    "has_timestamp",
+    "timezone",
+    "met_source",
+    "isd_station",
+    "quality_assurance",
+]
+
+# Sensor readings, votes, subject data and derived indices. Votes are not
+# integers in DB II (e.g. thermal_sensation -0.3, thermal_comfort 2.7)
+FLOAT_COLUMNS = [
+    "age",
+    "ht",
+    "wt",
+    "ta",
+    "ta_h",
+    "ta_m",
+    "ta_l",
+    "top",
+    "tr",
+    "tg",
+    "tg_h",
+    "tg_m",
+    "tg_l",
+    "rh",
+    "vel",
+    "vel_h",
+    "vel_m",
+    "vel_l",
+    "vel_r",
+    "met",
+    "clo",
+    "clo_d",
+    "activity_10",
+    "activity_20",
+    "activity_30",
+    "activity_60",
+    "thermal_sensation",
+    "thermal_comfort",
+    "t_out",
+    "rh_out",
+    "t_out_monthly",
+    "t_out_isd",
+    "rh_out_isd",
+    "t_mot_isd",
+    "set",
+    "pmv",
+    "ppd",
+    "pmv_ce",
+    "ppd_ce",
+    "lat",
+    "lon",
+    "isd_distance",
+    "database",
+]
+
+
+def db_dtypes(float_dtype="float32"):
+    """dtype map for read_csv covering the measurements and metadata columns
+
+    float32 keeps about 7 significant digits: enough to look at the data,
+    but not to recompute PMV/SET or to rewrite a CSV with the same text, so
+    pass float_dtype="float64" for those.
+    """
+    dtypes = dict(INT_COLUMNS)
+    dtypes.update({col: "Int8" for col in FLAG_COLUMNS})
+    dtypes.update({col: "category" for col in TEXT_COLUMNS})
+    dtypes.update({col: float_dtype for col in FLOAT_COLUMNS})
+    return dtypes
+
+
+def read_db_csv(path, columns=None, chunksize=None, float_dtype="float32"):
+    """Read a DB II measurements or metadata file (plain or gzip'd CSV)
+
+    columns projects the file as read_csv(usecols=...) does. With chunksize,
+    an iterator of DataFrames is returned; see concat_chunks to put them
+    back together. Columns missing from the schema are inferred as usual.
+    """
+    return pd.read_csv(
+        path,
+        usecols=columns,
+        dtype=db_dtypes(float_dtype),
+        chunksize=chunksize,
+        low_memory=False,
+    )
+
+
+def with_float_flags(df):
+    """df with the FLAG_COLUMNS it has as float64, so they are written as
+    1.0/0.0 like the published files rather than as read_db_csv's Int8"""
+    return df.astype({col: "float64" for col in FLAG_COLUMNS if col in df.columns})
+
+
+def concat_chunks(chunks):
+    """pd.concat for chunks from read_db_csv that keeps the categoricals
+
+    Each chunk has its own categories, which pd.concat would turn into
+    object columns; the categories are unioned instead. The index of the
+    chunks (the row number in the file) is kept.
+    """
+    chunks = list(chunks)
+    categorical = [
+        col
+        for col in chunks[0].columns
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype)
+    ]
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks])
+    for col in categorical:
+        parts = [chunk[col].array for chunk in chunks]
+        # A chunk where col is all missing has empty object categories
+        dtypes = [part.categories.dtype for part in parts if len(part.categories)]
+        if dtypes:
+            empty = pd.Index([], dtype=dtypes[0])
+            parts = [
+                (
+                    part
+                    if len(part.categories)
+                    else pd.Categorical.from_codes(part.codes, empty)
+                )
+                for part in parts
+            ]
+        df[col] = union_categoricals(parts)
+    return df[chunks[0].columns]
+
+
+# ===================== Benchmark =====================
+def benchmark(path="./v2.1.0/db_measurements_v2.1.0.csv.gz"):
+    """Load time, peak RSS and DataFrame size of each way of reading path"""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from dataset import measure
+
+    size = "df.memory_usage(deep=True).sum() / 2**20"
+    loaders = {
+        "read_csv(low_memory=False)": f"df = pd.read_csv({path!r}, low_memory=False)",
+        "schema, float64": f"df = read_db_csv({path!r}, float_dtype='float64')",
+        "schema, float32": f"df = read_db_csv({path!r})",
+        "schema, 10k-row chunks": (
+            f"df = concat_chunks(read_db_csv({path!r}, chunksize=10_000))"
+        ),
+        "schema, 8 columns": (
+            f"df = read_db_csv({path!r}, columns=['record_id', 'building_id', "
+            "'ta', 'tr', 'rh', 'vel', 'met', 'clo'])"
+        ),
+    }
+    setup = "import pandas as pd\nfrom db_loader import concat_chunks, read_db_csv\n"
+    baseline = measure(setup)[1]
+    print(f"=== Loading {path} ===")
+    print(f"   - interpreter + pandas: {baseline:.0f} MB")
+    for name, code in loaders.items():
+        elapsed, rss, output = measure(f"{setup}{code}\nprint({size})")
+        frame = float(output[0])
+        print(
+            f"   - {name:>28}: {elapsed:.2f}s, peak RSS {rss:.0f} MB, "
+            f"DataFrame {frame:.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    # Usage (from ashrae-db-II): python db_loader.py
+    benchmark()
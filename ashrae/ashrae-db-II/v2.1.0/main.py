@@ -1,11 +1,44 @@
+import argparse
+import functools
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
-from pythermalcomfort.models import pmv_ppd, set_tmp
-from pythermalcomfort.utilities import (
-    v_relative,
-    clo_dynamic,
-    running_mean_outdoor_temperature,
+from pythermalcomfort.utilities import running_mean_outdoor_temperature
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from comfort_cache import (  # noqa: E402
+    COMFORT_INPUTS,
+    ComfortCache,
+    comfort_indices,
 )
+from db_loader import concat_chunks, read_db_csv, with_float_flags  # noqa: E402
+from weather_index import WEATHER_FIELDS, WeatherIndex  # noqa: E402
+
+# rows parsed at a time when rebuilding the DB from the previous version
+READ_CHUNK_ROWS = 20_000
+# daily ISD weather per station, input of the running mean outdoor temperature
+WEATHER_PATH = "./v2.1.0/source_data/weather_data.gz"
+# the same with the running mean, and its index by station and date
+WEATHER_RMT_PATH = "./v2.1.0/source_data/weather_data_t_rmt.gz"
+WEATHER_INDEX_PATH = "./v2.1.0/weather_index"
+# running mean recomputed by calculate_running_mean_outdoor_temperature, kept
+# out of source_data so the shipped file is never rewritten
+RECOMPUTED_RMT_PATH = "./v2.1.0/weather_data_t_rmt.gz"
+# processes and rows per task for the PMV, PPD and SET computations
+COMFORT_WORKERS = os.cpu_count() or 1
+COMFORT_CHUNK_ROWS = 5_000
+# results of earlier builds, by input tuple; QUANTIZE rounds the inputs to
+# the sensor resolution before looking them up
+COMFORT_CACHE_PATH = "./v2.1.0/comfort_cache.sqlite"
+QUANTIZE = False
 
 
 def data_validation():
@@ -20,23 +53,15 @@ def data_validation():
     plt.rcParams["font.family"] = "sans-serif"
     plt.rcParams["figure.figsize"] = (7, 3)
 
-    db_210 = pd.read_csv(
-        "./v2.1.0/db_measurements_v2.1.0.csv.gz",
-        compression="gzip",
-        dtype={"air_movement_preference": str, "air_movement_acceptability": str},
-        low_memory=False,
-    )
+    # float32 readings and categorical text columns (see db_loader.py)
+    db_210 = read_db_csv("./v2.1.0/db_measurements_v2.1.0.csv.gz")
 
     # check data types
     for col in db_210.columns:
         print(col, set(type(x) for x in db_210[col].unique()))
         print(col, db_210[col].unique())
 
-    db_201 = pd.read_csv(
-        "./v2.1.0/source_data/db_measurements_v2.0.1.csv.gz",
-        compression="gzip",
-        low_memory=False,
-    )
+    db_201 = read_db_csv("./v2.1.0/source_data/db_measurements_v2.0.1.csv.gz")
 
     # check weather data
     plt.subplots(1, 1, constrained_layout=True)
@@ -44,9 +69,7 @@ def data_validation():
     plt.scatter(x="t_out_isd_x", y="t_out_isd_y", data=df_combined)
     plt.show()
 
-    _df_meta = pd.read_csv(
-        "./v2.1.0/db_metadata.csv",
-    )
+    _df_meta = read_db_csv("./v2.1.0/db_metadata.csv")
 
     # check PMV
     print(df_combined[["pmv_x", "pmv_y", "pmv_ce"]].describe().to_markdown())
@@ -127,20 +150,47 @@ def data_validation():
     plt.show()
 
 
-def calculate_running_mean_outdoor_temperature():
-    """This function calculates the running mean outdoor temperature using
-    pythermalcomfort function running_mean_outdoor_temperature.
+def running_mean_by_station(df_weather, alpha=0.8, days=7):
+    """t_rmt of every row of df_weather: the running mean of t_out_isd over the
+    days (7) calendar days before that date at the same station (code), or NaN
+    if any of those days is missing.
 
-    It uses the default values for alpha, and it calculates the value
-    using 7-day of data.
+    Gives the same values as calling running_mean_outdoor_temperature on each
+    window: the stations are sorted by date, shifted by 1..7 rows and a shift
+    only counts when it is exactly that many calendar days back. The weighted
+    sum is accumulated in the same order and rounded with Python's round.
     """
+    code = pd.factorize(df_weather.code)[0]  # -1 for a missing code
+    day = pd.to_datetime(df_weather.date).to_numpy("datetime64[D]").astype(np.int64)
+    order = np.lexsort((day, code))
+    code, day = code[order], day[order]
+    t_out = df_weather.t_out_isd.to_numpy(dtype=float)[order]
+    if ((code[1:] == code[:-1]) & (day[1:] == day[:-1])).any():
+        raise ValueError("weather data has more than one row per station and date")
+
+    coeff = [alpha**ix for ix in range(days)]
+    weighted = np.zeros(len(t_out))
+    complete = code >= 0
+    for shift in range(1, days + 1):
+        previous = np.full(len(t_out), np.nan)
+        previous[shift:] = t_out[:-shift]
+        in_window = np.zeros(len(t_out), dtype=bool)
+        in_window[shift:] = (code[shift:] == code[:-shift]) & (
+            day[shift:] - day[:-shift] == shift
+        )
+        weighted = weighted + coeff[shift - 1] * previous
+        complete &= in_window
+    t_rmt = weighted / sum(coeff)
+    t_rmt = np.array([round(value, 1) for value in t_rmt.tolist()])
 
-    df_weather = pd.read_csv(
-        "./v2.1.0/weather_data.gz",
-        compression="gzip",
-    )
+    result = np.full(len(t_out), np.nan)
+    result[order] = np.where(complete, t_rmt, np.nan)
+    return pd.Series(result, index=df_weather.index)
 
-    df_weather.date = pd.to_datetime(df_weather.date).dt.date
+
+def _running_mean_by_station_loop(df_weather):
+    """The original per-station, per-date loop (reference for running_mean_by_station)"""
+    df_weather = df_weather.copy()
     df_weather["t_rmt"] = np.nan
     for station in df_weather.code.unique():
         df_station = df_weather.query("code == @station").sort_values("date")
@@ -156,17 +206,78 @@ def calculate_running_mean_outdoor_temperature():
                 df_weather.loc[
                     (df_weather.code == station) & (df_weather.date == date), "t_rmt"
                 ] = t_rmt
+    return df_weather["t_rmt"]
 
-    df_weather.to_csv("./v2.1.0/weather_data_t_rmt.gz", compression="gzip", index=False)
 
+def read_weather(path):
+    df_weather = pd.read_csv(path, compression="gzip")
+    df_weather.date = pd.to_datetime(df_weather.date).dt.date
+    return df_weather
 
-if __name__ == "__main__":
 
-    # read old version of the DB
-    df = pd.read_csv(
-        "./v2.1.0/source_data/db_measurements_v2.0.1.csv.gz",
-        low_memory=False,
-        compression="gzip",
+def calculate_running_mean_outdoor_temperature():
+    """This function calculates the running mean outdoor temperature using
+    pythermalcomfort function running_mean_outdoor_temperature.
+
+    It uses the default values for alpha, and it calculates the value
+    using 7-day of data.
+    """
+
+    df_weather = read_weather(WEATHER_PATH)
+    df_weather["t_rmt"] = running_mean_by_station(df_weather)
+
+    df_weather.to_csv(RECOMPUTED_RMT_PATH, compression="gzip", index=False)
+
+
+def check_running_mean(path=WEATHER_PATH, num_stations=None):
+    """running_mean_by_station must match the original loop exactly (on the
+    first num_stations stations, all of them by default)"""
+    df_weather = read_weather(path)
+    if num_stations is not None:
+        stations = df_weather.code.unique()[:num_stations]
+        df_weather = df_weather[df_weather.code.isin(stations)]
+    expected = _running_mean_by_station_loop(df_weather).to_numpy()
+    actual = running_mean_by_station(df_weather).to_numpy()
+    assert np.array_equal(actual, expected, equal_nan=True)
+    print(
+        f"Running mean check passed on {len(df_weather)} rows "
+        f"({np.isfinite(actual).sum()} with a complete 7-day window)"
+    )
+
+
+def benchmark_running_mean(path=WEATHER_PATH, loop_stations=3):
+    """Time of the vectorized running mean over the whole file, and of the
+    original loop on the first loop_stations stations (extrapolated by rows)"""
+    df_weather = read_weather(path)
+    start = time.perf_counter()
+    running_mean_by_station(df_weather)
+    vectorized = time.perf_counter() - start
+
+    stations = df_weather.code.unique()[:loop_stations]
+    df_subset = df_weather[df_weather.code.isin(stations)]
+    start = time.perf_counter()
+    _running_mean_by_station_loop(df_subset)
+    loop = time.perf_counter() - start
+
+    print(f"=== Running mean outdoor temperature, {len(df_weather)} rows ===")
+    print(f"   - vectorized: {vectorized:.2f}s")
+    print(
+        f"   - loop: {loop:.2f}s for {len(df_subset)} rows of {loop_stations} "
+        f"stations, ~{loop * len(df_weather) / len(df_subset):.0f}s for all"
+    )
+
+
+def read_previous_version():
+    """DB II v2.0.1 with out-of-range records and the old PMV, PPD and SET
+    removed, and missing tr estimated from top"""
+    # read old version of the DB; float64 so PMV, PPD and SET are computed
+    # from the same inputs as before
+    df = concat_chunks(
+        read_db_csv(
+            "./v2.1.0/source_data/db_measurements_v2.0.1.csv.gz",
+            chunksize=READ_CHUNK_ROWS,
+            float_dtype="float64",
+        )
     )
 
     # dropping entries without ta and keeping only those with 10 < ta < 40
@@ -184,102 +295,297 @@ if __name__ == "__main__":
 
     # estimate mean radiant temperature from operative temperature
     df.loc[df.tr.isna(), "tr"] = 2 * df[df.tr.isna()].top - df[df.tr.isna()].ta
+    return df
 
+
+def pmv_inputs(df):
+    """Rows of df with everything needed for the PMV"""
     # drop rows which do not have the necessary data to calculate the PMV
-    df_pmv = df.copy().dropna(subset=["ta", "tr", "rh", "met", "vel", "clo"])
-
-    # calculate relative air speed and dynamic clothing
-    v_rel = v_relative(v=df_pmv["vel"], met=df_pmv["met"])
-    clo_d = clo_dynamic(clo=df_pmv["clo"], met=df_pmv["met"])
-    df_pmv["vel_r"] = v_rel
-    df_pmv["clo_d"] = clo_d
-
-    # calculate SET temperature
-    df_pmv["set"] = set_tmp(
-        tdb=df_pmv.ta,
-        tr=df_pmv.tr,
-        v=df_pmv.vel,
-        rh=df_pmv.rh,
-        met=df_pmv.met,
-        clo=df_pmv.clo,
-    )
+    return df.copy().dropna(subset=["ta", "tr", "rh", "met", "vel", "clo"])
 
-    df = pd.merge(df, df_pmv[["set"]], left_index=True, right_index=True, how="left")
 
-    # calculate different PMV indices
-    results = pmv_ppd(
-        tdb=df_pmv["ta"],
-        tr=df_pmv["tr"],
-        vr=df_pmv["vel_r"],
-        rh=df_pmv["rh"],
-        met=df_pmv["met"],
-        clo=df_pmv["clo_d"],
-        wme=0,
-        standard="ashrae",
-    )
+def comfort_indices_parallel(df_pmv, workers=1, chunk_rows=None):
+    """comfort_indices over chunks of df_pmv, run on a pool of workers processes
 
-    df_pmv["pmv_ce"] = results["pmv"]
-    df_pmv["ppd_ce"] = results["ppd"]
-
-    results = pmv_ppd(
-        tdb=df_pmv["ta"],
-        tr=df_pmv["tr"],
-        vr=df_pmv["vel_r"],
-        rh=df_pmv["rh"],
-        met=df_pmv["met"],
-        clo=df_pmv["clo_d"],
-        wme=0,
-        standard="iso",
-    )
+    Every index depends only on its own row, so the result, values and
+    index, is the same as comfort_indices(df_pmv) for any number of workers
+    or chunk size.
+    """
+    chunk_rows = chunk_rows or COMFORT_CHUNK_ROWS
+    df_pmv = df_pmv[COMFORT_INPUTS]  # only what the workers need is pickled
+    tasks = [
+        df_pmv.iloc[start : start + chunk_rows]
+        for start in range(0, len(df_pmv), chunk_rows)
+    ]
+    results = [None] * len(tasks)
+    start = time.perf_counter()
+    rows = 0
+
+    def report(done):
+        print(
+            f"   - Comfort indices: {done}/{len(tasks)} chunks, {rows}/{len(df_pmv)} "
+            f"rows, {time.perf_counter() - start:.1f}s ({workers} workers)"
+        )
 
-    df_pmv["pmv"] = results["pmv"]
-    df_pmv["ppd"] = results["ppd"]
+    if workers <= 1:
+        for index, chunk in enumerate(tasks):
+            results[index] = comfort_indices(chunk)
+            rows += len(chunk)
+            report(index + 1)
+        return pd.concat(results)
+
+    # compile pythermalcomfort's numba kernels once, before the workers fork
+    comfort_indices(df_pmv.iloc[:1])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(comfort_indices, chunk): index
+            for index, chunk in enumerate(tasks)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            results[index] = future.result()
+            rows += len(tasks[index])
+            report(done)
+    return pd.concat(results)
+
+
+def benchmark_comfort_indices(worker_counts=None, num_rows=None):
+    """Time comfort_indices_parallel for each worker count on the v2.0.1 rows
+    (the first num_rows of them) and check every result against a single
+    comfort_indices call"""
+    df_pmv = pmv_inputs(read_previous_version())
+    if num_rows is not None:
+        df_pmv = df_pmv.iloc[:num_rows]
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, 4, 8, os.cpu_count()} - {None})
+    comfort_indices(df_pmv.iloc[:1])  # numba compilation is not part of the timings
+
+    timings = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # one cooling-effect warning per row
+        for workers in worker_counts:
+            start = time.perf_counter()
+            indices = comfort_indices_parallel(df_pmv, workers=workers)
+            timings[workers] = time.perf_counter() - start
+            if workers == worker_counts[0]:
+                reference = comfort_indices(df_pmv)
+            assert indices.index.equals(reference.index)
+            for col in reference.columns:
+                assert np.array_equal(
+                    indices[col].to_numpy(), reference[col].to_numpy(), equal_nan=True
+                ), f"{col} differs with {workers} workers"
+
+    print(f"=== Comfort indices, {len(df_pmv)} rows, {os.cpu_count()} CPUs ===")
+    for workers, elapsed in timings.items():
+        print(
+            f"   - {workers} workers: {elapsed:.1f}s, speedup "
+            f"{timings[worker_counts[0]] / elapsed:.2f}x (results identical)"
+        )
 
-    df = pd.merge(
-        df,
-        df_pmv[["pmv", "ppd", "pmv_ce", "ppd_ce"]],
-        left_index=True,
-        right_index=True,
-        how="left",
-    )
 
-    # merge weather data
-    df_meta = pd.read_csv(
-        "./v2.1.0/db_metadata.csv",
-    )
+def benchmark_comfort_cache(num_rows=None):
+    """Time the comfort indices of the v2.0.1 rows (the first num_rows of
+    them) without the cache, with an empty and a full cache, and quantized,
+    and check the cached results against comfort_indices"""
+    df_pmv = pmv_inputs(read_previous_version())
+    if num_rows is not None:
+        df_pmv = df_pmv.iloc[:num_rows]
+    comfort_indices(df_pmv.iloc[:1])  # numba compilation is not part of the timings
+
+    timings = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # one cooling-effect warning per row
+        start = time.perf_counter()
+        reference = comfort_indices(df_pmv)
+        timings["no cache"] = time.perf_counter() - start
+        cache = ComfortCache(":memory:")
+        for name in ("empty cache", "full cache"):
+            start = time.perf_counter()
+            indices = cache.indices(df_pmv)
+            timings[name] = time.perf_counter() - start
+            assert indices.index.equals(reference.index)
+            for col in reference.columns:
+                assert np.array_equal(
+                    indices[col].to_numpy(), reference[col].to_numpy(), equal_nan=True
+                ), f"{col} differs with the {name}"
+        start = time.perf_counter()
+        quantized = ComfortCache(":memory:").indices(df_pmv, quantize=True)
+        timings["quantized, empty cache"] = time.perf_counter() - start
+
+    tuples = len(df_pmv[COMFORT_INPUTS].drop_duplicates())
+    print(f"=== Comfort indices, {len(df_pmv)} rows, {tuples} distinct inputs ===")
+    for name, elapsed in timings.items():
+        print(
+            f"   - {name:>22}: {elapsed:.2f}s, speedup "
+            f"{timings['no cache'] / elapsed:.2f}x"
+        )
+    error = (quantized["pmv"] - reference["pmv"]).abs()
+    print(f"   - Quantized PMV error: max {error.max():.3f}, mean {error.mean():.4f}")
+
+
+# ===================== Weather Lookup =====================
+def weather_by_index(df, df_meta):
+    """t_out_isd, rh_out_isd and t_rmt of the ISD station of each record's
+    building on the record's date, NaN where not known, by row of df"""
+    station = df["building_id"].map(df_meta.set_index("building_id")["isd_station"])
+    index = WeatherIndex.for_csv(WEATHER_RMT_PATH, WEATHER_INDEX_PATH)
+    return index.lookup(station, df["timestamp"], index=df.index)
 
+
+def _weather_by_merge(df, df_meta):
+    """The merges main.py used to run, as a frame like weather_by_index's"""
     # merging database II data with metadata since I need to get station number
     data = pd.merge(df, df_meta, on="building_id", how="left")
     data.timestamp = pd.to_datetime(data.timestamp).dt.date
 
     # open the weather data file
-    df_rmt = pd.read_csv(
-        "./v2.1.0/source_data/weather_data_t_rmt.gz", compression="gzip"
-    )
+    df_rmt = pd.read_csv(WEATHER_RMT_PATH, compression="gzip")
     df_rmt.date = pd.to_datetime(df_rmt.date).dt.date
 
     # merge database II data with weather data
     test = pd.merge(
-        data[
-            [
-                "isd_station",
-                "timestamp",
-                "contributor",
-            ]
-        ],
+        data[["isd_station", "timestamp", "contributor"]],
         df_rmt,
         left_on=["isd_station", "timestamp"],
         right_on=["code", "date"],
         how="left",
     )
+    return test[WEATHER_FIELDS].set_axis(df.index)
+
+
+def benchmark_weather_lookup():
+    """Time and peak allocations of the weather lookup of the v2.0.1 rows by
+    merge and by index (cold: index built, warm: index reused), checking the
+    results match"""
+    df = read_previous_version()
+    df_meta = read_db_csv("./v2.1.0/db_metadata.csv", float_dtype="float64")
+    results = {}
+    print(f"=== Weather lookup, {len(df)} rows ===")
+    for name, lookup, cold in (
+        ("pd.merge", _weather_by_merge, False),
+        ("index, cold", weather_by_index, True),
+        ("index, warm", weather_by_index, False),
+    ):
+        if cold:
+            shutil.rmtree(WEATHER_INDEX_PATH, ignore_errors=True)
+        start = time.perf_counter()
+        results[name] = lookup(df, df_meta)
+        elapsed = time.perf_counter() - start
+
+        # again for the allocations, tracemalloc slows the timings down
+        if cold:
+            shutil.rmtree(WEATHER_INDEX_PATH, ignore_errors=True)
+        tracemalloc.start()
+        lookup(df, df_meta)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"   - {name:>11}: {elapsed * 1000:.0f} ms, peak {peak / 2**20:.1f} MB")
+    for name, result in results.items():
+        assert result.equals(results["pd.merge"]), f"{name} differs from pd.merge"
+    known = results["pd.merge"].notna().all(axis=1).sum()
+    print(f"   - Results identical; {known} rows with all weather fields")
+
+
+if __name__ == "__main__":
+    # Usage (from ashrae-db-II):
+    #   python v2.1.0/main.py [--workers N] [--quantize] [--no-cache]
+    #   [--benchmark-running-mean] [--benchmark-comfort [N ...]]
+    #   [--benchmark-cache] [--benchmark-weather]
+    parser = argparse.ArgumentParser(description="Rebuild DB II v2.1.0")
+    parser.add_argument(
+        "--benchmark-running-mean",
+        action="store_true",
+        help="check the vectorized running mean against the loop, time both and exit",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=COMFORT_WORKERS,
+        help="processes for the PMV, PPD and SET computations",
+    )
+    parser.add_argument(
+        "--benchmark-comfort",
+        nargs="*",
+        type=int,
+        metavar="WORKERS",
+        help="time the comfort indices for these worker counts, check they match and exit",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="round the PMV inputs to the sensor resolution before computing",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="recompute every comfort index instead of reusing earlier builds",
+    )
+    parser.add_argument(
+        "--benchmark-cache",
+        action="store_true",
+        help="time the comfort indices with and without the cache, check them and exit",
+    )
+    parser.add_argument(
+        "--benchmark-weather",
+        action="store_true",
+        help="time the weather lookup by merge and by index, check them and exit",
+    )
+    args = parser.parse_args()
+    COMFORT_WORKERS = args.workers
+    QUANTIZE = args.quantize
+    if args.no_cache:
+        COMFORT_CACHE_PATH = ":memory:"
+    if args.benchmark_running_mean:
+        check_running_mean(num_stations=10)
+        benchmark_running_mean()
+        sys.exit()
+    if args.benchmark_comfort is not None:
+        benchmark_comfort_indices(args.benchmark_comfort or None)
+        sys.exit()
+    if args.benchmark_cache:
+        benchmark_comfort_cache()
+        sys.exit()
+    if args.benchmark_weather:
+        benchmark_weather_lookup()
+        sys.exit()
+
+    df = read_previous_version()
+    df_pmv = pmv_inputs(df)
+
+    # calculate SET temperature and the different PMV indices, once per
+    # distinct input tuple not computed by an earlier build, in chunks on
+    # COMFORT_WORKERS processes
+    cache = ComfortCache(COMFORT_CACHE_PATH)
+    indices = cache.indices(
+        df_pmv,
+        quantize=QUANTIZE,
+        compute=functools.partial(comfort_indices_parallel, workers=COMFORT_WORKERS),
+    )
+    cache.report()
+    cache.close()
+    df_pmv = df_pmv.join(indices)
+
+    df = pd.merge(df, df_pmv[["set"]], left_index=True, right_index=True, how="left")
+    df = pd.merge(
+        df,
+        df_pmv[["pmv", "ppd", "pmv_ce", "ppd_ce"]],
+        left_index=True,
+        right_index=True,
+        how="left",
+    )
+
+    # look up the weather of each record: station from the metadata, then
+    # the station's day in the weather index
+    df_meta = read_db_csv("./v2.1.0/db_metadata.csv", float_dtype="float64")
+    weather = weather_by_index(df, df_meta)
 
     df.reset_index(inplace=True)
-    test.reset_index(inplace=True)
 
     # replace old weather data with new one
-    df[["rh_out_isd", "t_out_isd"]] = test[["rh_out_isd", "t_out_isd"]].values
+    df[["rh_out_isd", "t_out_isd"]] = weather[["rh_out_isd", "t_out_isd"]].to_numpy()
 
-    df["t_mot_isd"] = test[["t_rmt"]].values
+    df["t_mot_isd"] = weather[["t_rmt"]].to_numpy()
 
     # save a new and updated version of the DB II
+    df = with_float_flags(df)
     df.to_csv("./v2.1.0/db_measurements_v2.1.0.csv.gz", compression="gzip", index=False)
@@ -0,0 +1,98 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# ===================== Weather Index =====================
+# Columns of the daily weather file kept in the index
+WEATHER_FIELDS = ["t_out_isd", "rh_out_isd", "t_rmt"]
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of the date of each timestamp (the date .dt.date
+    gives, in the timestamps' own time zone) and whether it is known"""
+    dates = pd.to_datetime(pd.Series(dates))
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    known = dates.notna().to_numpy()
+    days = dates.dt.normalize().to_numpy().astype("datetime64[D]").astype(np.int64)
+    return days, known
+
+
+def _keys(station_ids, days):
+    """One sortable int64 per (station, day): station in the high 32 bits"""
+    return station_ids.astype(np.int64) * (1 << 32) + days
+
+
+def build_weather_index(csv_path, index_path, fields=WEATHER_FIELDS):
+    """Write the index of a daily weather file (code, date and fields columns)
+
+    The index is a directory with the (code, date) keys sorted in keys.npy,
+    the fields of each key in the rows of values.npy and the station codes
+    in index.json, which is written last.
+    """
+    df = pd.read_csv(csv_path, usecols=["code", "date", *fields])
+    if df[["code", "date"]].isna().any().any():
+        raise ValueError(f"{csv_path}: rows without a station code or date")
+    stations = pd.Index(sorted(df["code"].unique()))
+    days, _ = day_numbers(df["date"])
+    keys = _keys(stations.get_indexer(df["code"]), days)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    if (np.diff(keys) == 0).any():
+        raise ValueError(f"{csv_path}: more than one row for a station and date")
+
+    index_path = Path(index_path)
+    index_path.mkdir(parents=True, exist_ok=True)
+    np.save(index_path / "keys.npy", keys)
+    np.save(index_path / "values.npy", df[fields].to_numpy(np.float64)[order])
+    with open(index_path / "index.json", "w") as f:
+        json.dump({"fields": fields, "stations": stations.tolist()}, f)
+
+
+def has_weather_index(csv_path, index_path):
+    """True if index_path holds an index at least as recent as csv_path"""
+    marker = Path(index_path) / "index.json"
+    return marker.exists() and marker.stat().st_mtime >= Path(csv_path).stat().st_mtime
+
+
+class WeatherIndex:
+    """Memory-mapped weather index written by build_weather_index
+
+    Only the station codes are read when the index is opened; lookups
+    binary-search the sorted keys and read just the rows they find.
+    """
+
+    def __init__(self, index_path):
+        index_path = Path(index_path)
+        with open(index_path / "index.json") as f:
+            meta = json.load(f)
+        self.fields = meta["fields"]
+        self.stations = pd.Index(meta["stations"], dtype=object)
+        self.keys = np.load(index_path / "keys.npy", mmap_mode="r")
+        self.values = np.load(index_path / "values.npy", mmap_mode="r")
+
+    @classmethod
+    def for_csv(cls, csv_path, index_path):
+        """Open the index of csv_path, (re)building it if it is missing or stale"""
+        if not has_weather_index(csv_path, index_path):
+            build_weather_index(csv_path, index_path)
+        return cls(index_path)
+
+    def lookup(self, station, dates, index=None):
+        """DataFrame of the fields for each (station code, date) pair, with
+        index as its index; NaN where the station or the day is not indexed"""
+        station_ids = self.stations.get_indexer(pd.Index(station, dtype=object))
+        days, known = day_numbers(dates)
+        wanted = np.flatnonzero((station_ids >= 0) & known)
+        keys = _keys(station_ids[wanted], days[wanted])
+
+        found = np.zeros(len(wanted), dtype=bool)
+        positions = np.searchsorted(self.keys, keys)
+        inside = positions < len(self.keys)
+        found[inside] = self.keys[positions[inside]] == keys[inside]
+
+        values = np.full((len(days), len(self.fields)), np.nan)
+        values[wanted[found]] = self.values[positions[found]]
+        return pd.DataFrame(values, index=index, columns=self.fields)
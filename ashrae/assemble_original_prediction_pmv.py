@@ -2,34 +2,24 @@ import os
 
 import pandas as pd
 
-target_file_path = "./ashrae-db-II/measurements.csv"
-df = pd.read_csv(target_file_path, nrows=8100)
-df_pmv = pd.DataFrame(columns=["PMV_float_base", "PMV_string_base"])
-df_pmv["PMV_float_base"] = df["pmv"]
-# convert captial PMV values to lowercase
-df_pmv["PMV_string_base"] = df_pmv["PMV_string_base"].str.lower()
-
+from dataset import read_measurements
+from merge_shards import SHARD_FILE
+from pmv_scale import pmv_category
 
-for i in range(0, len(df_pmv["PMV_float_base"])):
-    if df_pmv.loc[i, "PMV_float_base"] < -2.5:
-        df_pmv.loc[i, "PMV_string_base"] = "cold"
-    elif df_pmv.loc[i, "PMV_float_base"] < -1.5:
-        df_pmv.loc[i, "PMV_string_base"] = "cool"
-    elif df_pmv.loc[i, "PMV_float_base"] < -0.5:
-        df_pmv.loc[i, "PMV_string_base"] = "slightly cool"
-    elif df_pmv.loc[i, "PMV_float_base"] < 0.5:
-        df_pmv.loc[i, "PMV_string_base"] = "neutral"
-    elif df_pmv.loc[i, "PMV_float_base"] < 1.5:
-        df_pmv.loc[i, "PMV_string_base"] = "slightly warm"
-    elif df_pmv.loc[i, "PMV_float_base"] < 2.5:
-        df_pmv.loc[i, "PMV_string_base"] = "warm"
-    else:
-        df_pmv.loc[i, "PMV_string_base"] = "hot"
+target_file_path = "./ashrae-db-II/measurements.csv"
+# only the reference PMV is needed (typed columnar copy if ashrae.py wrote one)
+df = read_measurements(target_file_path, columns=["pmv"], nrows=8100)
+df_pmv = pd.DataFrame(
+    {"PMV_float_base": df["pmv"], "PMV_string_base": pmv_category(df["pmv"])}
+)
 
 pmv_path = "./prediction"
 
-# loop all fies in the folder
+# loop all fies in the folder; shard files are partial and carry a record
+# column, their merged <stem>.csv (merge_shards.py) is assembled instead
 for filename in os.listdir(pmv_path):
+    if SHARD_FILE.match(filename):
+        continue
     file_path = os.path.join(pmv_path, filename)
     df = pd.read_csv(file_path)
     df_pmv_llm = pd.concat([df_pmv, df], axis=1)
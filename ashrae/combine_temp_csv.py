@@ -2,18 +2,42 @@ import os
 
 import pandas as pd
 
+from merge_shards import SHARD_FILE
+from run_journal import RunJournal
+
 # set folder path
-folder_path = "./temp"
+folder_path = "./journal"
 
-# loop all fies in the folder
-file_list = []
+# loop all journal files in the folder (one per model)
 for filename in os.listdir(folder_path):
     file_path = os.path.join(folder_path, filename)
-    # check if it is a file
-    if os.path.isfile(file_path):
-        file_list.append(file_path)
+    # check if it is a journal file
+    if not (os.path.isfile(file_path) and filename.endswith(".jsonl")):
+        continue
+
+    # the last complete line holds the model and prompt version of the latest run
+    journal = RunJournal(file_path)
+    last_entry = journal.last_entry()
+    if last_entry is None:
+        journal.close()
+        continue
+    entries = journal.read_entries(last_entry["model"], last_entry["prompt_version"])
+
+    # rebuild the prediction file in record order, empty rows for missing records
+    stem = filename.rsplit(".", 1)[0]
+    shard = SHARD_FILE.match(stem + ".csv")
+    if shard:
+        # shard journals only hold records r with r % count == index
+        records = range(int(shard["index"]), max(entries) + 1, int(shard["count"]))
+    else:
+        records = range(max(entries) + 1)
+    df = pd.DataFrame(
+        journal.results(last_entry["model"], last_entry["prompt_version"], records)
+    )
+    journal.close()
+    if shard:
+        # keep the record id so merge_shards.py can check and reorder
+        df.insert(0, "record", list(records))
 
-# read all csv files in the folder and combine them into one dataframe
-df = pd.concat([pd.read_csv(file) for file in file_list])
-# save the combined dataframe as a new csv file
-df.to_csv("combined.csv", index=False)
+    # save the combined dataframe as a new csv file
+    df.to_csv(f"./prediction/{stem}.csv", index=False)
@@ -0,0 +1,121 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # Optional: typed, memory-mapped copy of measurements.csv
+    pa = None
+
+
+def columnar_path(csv_path):
+    """Feather file that ashrae.py writes next to measurements.csv"""
+    return Path(csv_path).with_suffix(".feather")
+
+
+def has_columnar(csv_path):
+    """True if an up-to-date Feather copy of csv_path can be read"""
+    path = columnar_path(csv_path)
+    return (
+        pa is not None
+        and path.exists()
+        and path.stat().st_mtime >= Path(csv_path).stat().st_mtime
+    )
+
+
+def read_measurements(csv_path, columns=None, nrows=None, columnar=True):
+    """Read the LLM dataset, only the requested columns and the first nrows
+
+    columns is None (all), a list of names or a predicate over names, as in
+    read_csv(usecols=...); columns keep their file order. The Feather copy is
+    memory-mapped, so columns that are not requested are never read and
+    category columns arrive as pandas categoricals; without it (or without
+    pyarrow) the CSV is parsed instead.
+    """
+    if not (columnar and has_columnar(csv_path)):
+        return pd.read_csv(csv_path, usecols=columns, nrows=nrows)
+
+    # read_all() over the memory map only maps the file; pages are touched
+    # when the selected columns are converted
+    table = pa.ipc.open_file(pa.memory_map(str(columnar_path(csv_path)))).read_all()
+    names = table.column_names
+    if callable(columns):
+        names = [name for name in names if columns(name)]
+    elif columns is not None:
+        names = [name for name in names if name in set(columns)]
+    table = table.select(names)
+    if nrows is not None:
+        table = table.slice(0, nrows)
+    return table.to_pandas()
+
+
+# ===================== Equivalence Check and Benchmark =====================
+def check_equivalence(csv_path="./ashrae-db-II/measurements.csv"):
+    """The prompts built from the Feather copy must match those from the CSV"""
+    from sentences import build_sentences, column_descriptions, load_measurements
+
+    from_csv = load_measurements(csv_path, columnar=False)
+    from_feather = load_measurements(csv_path)
+    assert list(from_csv.columns) == list(from_feather.columns)
+    assert build_sentences(from_csv, column_descriptions) == build_sentences(
+        from_feather, column_descriptions
+    )
+    print(f"Equivalence check passed on {len(from_csv)} rows")
+
+
+def measure(code):
+    """Wall time, peak RSS and the other output of code run in a fresh
+    interpreter"""
+    # VmHWM starts afresh with the new interpreter, while ru_maxrss would
+    # carry over the peak of this (forking) process
+    script = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"{code}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "peak = [line for line in open('/proc/self/status') if line.startswith('VmHWM')]\n"
+        "print(elapsed, peak[0].split()[1])\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(output[-2]), int(output[-1]) / 1024, output[:-2]  # VmHWM in kB
+
+
+def benchmark(csv_path="./ashrae-db-II/measurements.csv", nrows=None):
+    """Startup time and peak RSS of each stage's load, CSV vs Feather"""
+    stages = {
+        "predict.py": (
+            "from sentences import load_measurements\n"
+            f"load_measurements({csv_path!r}, nrows={nrows}, columnar={{columnar}})"
+        ),
+        "assemble (pmv only)": (
+            "from dataset import read_measurements\n"
+            f"read_measurements({csv_path!r}, columns=['pmv'], nrows={nrows}, "
+            "columnar={columnar})"
+        ),
+    }
+    baseline = measure("import pandas")
+    print(
+        f"Loading {csv_path} (nrows={nrows}); interpreter + pandas: "
+        f"{baseline[0]:.2f}s, {baseline[1]:.0f} MB"
+    )
+    for stage, code in stages.items():
+        for columnar in (False, True):
+            elapsed, rss, _ = measure(code.format(columnar=columnar))
+            source = "feather" if columnar else "csv"
+            print(
+                f"{stage:>20} from {source:>7}: {elapsed:.2f}s, peak RSS {rss:.0f} MB"
+            )
+
+
+if __name__ == "__main__":
+    # Usage: python dataset.py (after ashrae.py has written measurements.feather)
+    if not has_columnar("./ashrae-db-II/measurements.csv"):
+        print("No up-to-date measurements.feather (or pyarrow missing), run ashrae.py")
+    else:
+        check_equivalence()
+        benchmark(nrows=8100)
+        benchmark()
@@ -0,0 +1,119 @@
+import time
+
+import openai
+
+
+class HostState:
+    """Runtime bookkeeping for one inference endpoint"""
+
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+        self.in_flight = 0
+        self.latency = None  # Exponentially weighted mean latency [s]
+        self.completed = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def is_healthy(self, now):
+        return now >= self.unhealthy_until
+
+
+class HostDispatcher:
+    """Spread chat completion requests across every host in host_list
+
+    Each request goes to the healthy host with the lowest expected wait,
+    estimated as its observed mean latency times its in-flight load. A host
+    that fails max_failures times in a row is benched for cooldown seconds;
+    the failed request raises so the caller can retry it, and the retry is
+    dispatched to another host.
+    """
+
+    def __init__(
+        self,
+        host_list,
+        api_key="tceval",
+        max_failures=3,
+        cooldown=30.0,
+        smoothing=0.3,
+    ):
+        # Client-side retries are disabled so failures surface here and the
+        # request can be re-dispatched to a different host
+        self.hosts = [
+            HostState(
+                url, openai.AsyncOpenAI(base_url=url, api_key=api_key, max_retries=0)
+            )
+            for url in host_list
+        ]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+
+    def _expected_wait(self, host, default_latency):
+        latency = host.latency if host.latency is not None else default_latency
+        return latency * (host.in_flight + 1)
+
+    def pick_host(self):
+        """Return the host that should serve the next request"""
+        now = time.monotonic()
+        candidates = [host for host in self.hosts if host.is_healthy(now)]
+        if not candidates:
+            # Every host is benched: probe the one that comes back first
+            return min(self.hosts, key=lambda host: host.unhealthy_until)
+
+        # Unmeasured hosts are assumed to be as fast as the fastest known one
+        known = [host.latency for host in self.hosts if host.latency is not None]
+        default_latency = min(known) if known else 1.0
+        return min(
+            candidates,
+            key=lambda host: (
+                self._expected_wait(host, default_latency),
+                host.in_flight,
+            ),
+        )
+
+    def _record_success(self, host, elapsed):
+        host.completed += 1
+        host.consecutive_failures = 0
+        host.unhealthy_until = 0.0
+        if host.latency is None:
+            host.latency = elapsed
+        else:
+            host.latency += self.smoothing * (elapsed - host.latency)
+
+    def _record_failure(self, host, error):
+        host.failed += 1
+        host.consecutive_failures += 1
+        now = time.monotonic()
+        if host.consecutive_failures >= self.max_failures and host.is_healthy(now):
+            host.unhealthy_until = now + self.cooldown
+            print(
+                f"Host {host.url} marked unhealthy for {self.cooldown:.0f}s "
+                f"after {host.consecutive_failures} consecutive failures: {error}"
+            )
+
+    async def submit(self, request_fn):
+        """Run request_fn(client) on the selected host and return its result"""
+        host = self.pick_host()
+        host.in_flight += 1
+        start = time.monotonic()
+        try:
+            result = await request_fn(host.client)
+        except Exception as e:
+            self._record_failure(host, e)
+            raise
+        finally:
+            host.in_flight -= 1
+        self._record_success(host, time.monotonic() - start)
+        return result
+
+    def report(self, label=None):
+        """Print per-host request counts and latency"""
+        print(f"\n=== Host Dispatch Summary{f' ({label})' if label else ''} ===")
+        for host in self.hosts:
+            latency = f"{host.latency:.2f}s" if host.latency is not None else "n/a"
+            print(
+                f"   - {host.url}: {host.completed} completed, {host.failed} failed, "
+                f"mean latency {latency}"
+            )
@@ -0,0 +1,80 @@
+import argparse
+import re
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+# Prediction files written by predict.py --shard i/N
+SHARD_FILE = re.compile(r"^(?P<stem>.+)\.shard-(?P<index>\d+)-of-(?P<count>\d+)\.csv$")
+
+
+def find_shards(folder):
+    """Return {stem: {shard index: (shard count, path)}} for every shard file"""
+    shards = defaultdict(dict)
+    for path in sorted(Path(folder).glob("*.shard-*-of-*.csv")):
+        match = SHARD_FILE.match(path.name)
+        if match:
+            shards[match["stem"]][int(match["index"])] = (int(match["count"]), path)
+    return shards
+
+
+def merge_shards(folder, stem, shard_files, num_records=None):
+    """Check that every record is present exactly once and write the merged
+    prediction file in record order (same layout as an unsharded run)"""
+    counts = {count for count, _ in shard_files.values()}
+    if len(counts) != 1:
+        raise ValueError(f"{stem}: shard files disagree on the shard count {counts}")
+    num_shards = counts.pop()
+    missing_shards = sorted(set(range(num_shards)) - set(shard_files))
+    if missing_shards:
+        raise ValueError(f"{stem}: missing shards {missing_shards} of {num_shards}")
+
+    frames = []
+    for index, (_, path) in sorted(shard_files.items()):
+        df = pd.read_csv(path)
+        # predict.py assigns record r to shard r % N
+        stray = df.loc[df["record"] % num_shards != index, "record"]
+        if not stray.empty:
+            raise ValueError(
+                f"{path.name}: records {stray.tolist()[:10]} belong to other shards"
+            )
+        frames.append(df)
+    merged = pd.concat(frames, ignore_index=True)
+
+    duplicated = merged.loc[merged["record"].duplicated(), "record"]
+    if not duplicated.empty:
+        raise ValueError(
+            f"{stem}: records present more than once {duplicated.tolist()[:10]}"
+        )
+    if num_records is None:
+        num_records = merged["record"].max() + 1
+    missing = sorted(set(range(num_records)) - set(merged["record"]))
+    if missing or len(merged) != num_records:
+        raise ValueError(
+            f"{stem}: {len(missing)} records missing (first {missing[:10]}), "
+            f"{len(merged)} rows for {num_records} records"
+        )
+
+    merged = merged.sort_values("record").drop(columns="record")
+    merged.to_csv(Path(folder) / f"{stem}.csv", index=False)
+    print(f"[{stem}] Merged {num_shards} shards, {num_records} records -> {stem}.csv")
+
+
+if __name__ == "__main__":
+    # Usage: python merge_shards.py [--records 8100] once every shard's
+    # prediction file has been copied into ./prediction
+    parser = argparse.ArgumentParser(description="Merge sharded prediction files")
+    parser.add_argument("--folder", default="./prediction")
+    parser.add_argument(
+        "--records",
+        type=int,
+        help="expected number of records (default: highest record id + 1)",
+    )
+    args = parser.parse_args()
+
+    shards = find_shards(args.folder)
+    if not shards:
+        print(f"No shard files in {args.folder}")
+    for stem, shard_files in shards.items():
+        merge_shards(args.folder, stem, shard_files, args.records)
@@ -0,0 +1,416 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pmv_scale import category_of
+
+# ===================== 1. Load Profiles =====================
+# ttft and reasoning_tokens are lognormal (median, sigma); tokens_per_second is
+# the decode speed of one stream; trailing_tokens of prose follow the answer.
+# Prompt tokens missing from the simulated prefix (KV) cache add
+# 1 / prefill_tokens_per_second each to the time to first token.
+PROFILES = {
+    "fast": dict(
+        ttft=(0.02, 0.2),
+        tokens_per_second=2000.0,
+        reasoning_tokens=(30, 0.5),
+        trailing_tokens=0,
+        error_rate=0.0,
+        malformed_rate=0.0,
+        reasoning_style="field",
+        prefill_tokens_per_second=50000.0,
+        prefix_cache=True,
+    ),
+    "realistic": dict(
+        ttft=(0.3, 0.5),
+        tokens_per_second=40.0,
+        reasoning_tokens=(400, 0.8),
+        trailing_tokens=40,
+        error_rate=0.01,
+        malformed_rate=0.03,
+        reasoning_style="field",
+        prefill_tokens_per_second=4000.0,
+        prefix_cache=True,
+    ),
+    "flaky": dict(
+        ttft=(0.5, 1.0),
+        tokens_per_second=30.0,
+        reasoning_tokens=(800, 1.0),
+        trailing_tokens=80,
+        error_rate=0.15,
+        malformed_rate=0.15,
+        reasoning_style="inline",
+        prefill_tokens_per_second=2000.0,
+        prefix_cache=True,
+    ),
+}
+
+# Ways a reply can go wrong; the first four are recoverable by the repairs in
+# response_parser, the rest force a re-ask
+MALFORMATIONS = [
+    "single_quotes",
+    "trailing_comma",
+    "bare_keys",
+    "plus_sign",
+    "truncated",
+    "out_of_range",
+    "prose",
+]
+# Characters per cached KV block (about 16 tokens); only whole blocks that
+# continue an already cached prefix are reused, as in vLLM and llama.cpp
+PREFIX_BLOCK = 64
+PREFIX_CACHE_BLOCKS = 200_000
+BATCH_PATTERN = re.compile(r"measurements of (\d+) different")
+REASONING_WORDS = (
+    "the air temperature and humidity suggest a heat balance close to "
+    "neutral but clothing and metabolic rate shift it slightly so"
+).split()
+
+
+# ===================== 2. Deterministic Completions =====================
+def request_key(body):
+    """Hash of everything that defines the completion a real server would sample"""
+    fields = {k: body.get(k) for k in ("model", "messages", "temperature", "seed")}
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prompt_text(body):
+    """The prompt as the server would tokenize it (chat template stand-in)"""
+    return "".join(
+        f"<|{message['role']}|>{message['content']}" for message in body["messages"]
+    )
+
+
+def lognormal(rng, median, sigma):
+    return rng.lognormvariate(0.0, sigma) * median
+
+
+def make_answer(rng):
+    p_float = round(rng.uniform(-3.0, 3.0), 2)
+    return {"P_float": p_float, "P_string": category_of(p_float)}
+
+
+def malform(answer_json, kind):
+    """Render one answer object in a broken way"""
+    if kind == "single_quotes":
+        return answer_json.replace('"', "'")
+    if kind == "trailing_comma":
+        return answer_json[:-1] + ",}"
+    if kind == "bare_keys":
+        return re.sub(r'"(P_float|P_string)"', r"\1", answer_json)
+    if kind == "plus_sign":
+        return re.sub(r'("P_float": )(\d)', r"\1+\2", answer_json)
+    if kind == "truncated":
+        return answer_json[: len(answer_json) // 2]
+    if kind == "out_of_range":
+        return re.sub(r'("P_float": )-?[\d.]+', r"\g<1>4.5", answer_json)
+    return "I cannot determine the thermal sensation from these measurements."
+
+
+def plan_completion(body, rng, profile):
+    """Decide the whole completion up front: error, timing, reasoning and content"""
+    if rng.random() < profile["error_rate"]:
+        return {"error": rng.choice([429, 500, 503]), "ttft": rng.uniform(0.0, 0.05)}
+
+    user = body["messages"][-1]["content"]
+    match = BATCH_PATTERN.search(user)
+    if match:
+        answer = {"results": [make_answer(rng) for _ in range(int(match.group(1)))]}
+    else:
+        answer = make_answer(rng)
+    answer_json = json.dumps(answer)
+    malformation = None
+    if rng.random() < profile["malformed_rate"]:
+        malformation = rng.choice(MALFORMATIONS)
+        answer_json = malform(answer_json, malformation)
+
+    reasoning_length = round(lognormal(rng, *profile["reasoning_tokens"]))
+    reasoning = [
+        REASONING_WORDS[n % len(REASONING_WORDS)] + " " for n in range(reasoning_length)
+    ]
+    # About four characters per answer token, like a BPE tokenizer on JSON
+    content = ["```json\n"]
+    content += [answer_json[n : n + 4] for n in range(0, len(answer_json), 4)]
+    content += ["\n```"] + [" Values are consistent."] * profile["trailing_tokens"]
+    return {
+        "ttft": lognormal(rng, *profile["ttft"]),
+        "reasoning": reasoning,
+        "content": content,
+        "malformation": malformation,
+    }
+
+
+# ===================== 3. OpenAI-Compatible HTTP Server =====================
+class MockServer(ThreadingHTTPServer):
+    """Local stand-in for an OpenAI-compatible /v1/chat/completions endpoint
+
+    Replies are seeded by the request content and by how many times the same
+    request was seen before, so a rerun with the same requests in the same
+    order gets identical replies, while a re-ask of a malformed reply draws
+    a new one (as a sampling server would).
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, port, profile="realistic", seed=0, host="127.0.0.1"):
+        super().__init__((host, port), MockHandler)
+        self.profile = dict(PROFILES[profile]) if isinstance(profile, str) else profile
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.seen = Counter()
+        self.stats = Counter()
+        self.prefix_blocks = OrderedDict()
+
+    def rng_for(self, body):
+        key = request_key(body)
+        with self.lock:
+            attempt = self.seen[key]
+            self.seen[key] += 1
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def cached_prefix(self, text):
+        """Length of the cached prefix of text in characters; every block of
+        text is cached afterwards, least recently used blocks are evicted"""
+        if not self.profile["prefix_cache"]:
+            return 0
+        chained = hashlib.sha256()
+        cached = 0
+        with self.lock:
+            for start in range(0, len(text) - PREFIX_BLOCK + 1, PREFIX_BLOCK):
+                # Each block is keyed by the hash of the whole prefix up to it
+                chained.update(text[start : start + PREFIX_BLOCK].encode("utf-8"))
+                key = chained.hexdigest()
+                if key in self.prefix_blocks:
+                    self.prefix_blocks.move_to_end(key)
+                    if cached == start:
+                        cached += PREFIX_BLOCK
+                else:
+                    self.prefix_blocks[key] = None
+            while len(self.prefix_blocks) > PREFIX_CACHE_BLOCKS:
+                self.prefix_blocks.popitem(last=False)
+        return cached
+
+    def start(self):
+        """Serve from a background thread (for load tests inside one process)"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def report(self):
+        print("\n=== Mock Server Summary ===")
+        print(
+            "   - " + " | ".join(f"{key}: {n}" for key, n in sorted(self.stats.items()))
+        )
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/v1/models":
+            return self.send_json(404, {"error": {"message": "not found"}})
+        self.send_json(200, {"object": "list", "data": []})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            return self.send_json(404, {"error": {"message": "not found"}})
+        server = self.server
+        plan = plan_completion(body, server.rng_for(body), server.profile)
+        if "error" not in plan:
+            prompt = prompt_text(body)
+            plan["prompt_tokens"] = len(prompt) // 4
+            plan["cached_tokens"] = server.cached_prefix(prompt) // 4
+            uncached = plan["prompt_tokens"] - plan["cached_tokens"]
+            plan["ttft"] += uncached / server.profile["prefill_tokens_per_second"]
+        time.sleep(plan["ttft"])
+        with server.lock:
+            server.stats["requests"] += 1
+            if "error" in plan:
+                server.stats[f"http_{plan['error']}"] += 1
+            elif plan["malformation"]:
+                server.stats[plan["malformation"]] += 1
+        if "error" in plan:
+            return self.send_json(
+                plan["error"], {"error": {"message": "mock server error"}}
+            )
+        if body.get("stream"):
+            self.stream(body, plan)
+        else:
+            self.complete(body, plan)
+
+    def token_pieces(self, plan):
+        """(field, text) per generated token in output order"""
+        style = self.server.profile["reasoning_style"]
+        content = [("content", token) for token in plan["content"]]
+        if style == "inline":
+            reasoning = ["<think>"] + plan["reasoning"] + ["</think>"]
+            return [("content", token) for token in reasoning] + content
+        if style == "field":
+            return [
+                ("reasoning_content", token) for token in plan["reasoning"]
+            ] + content
+        return content
+
+    def usage(self, plan, pieces):
+        return {
+            "prompt_tokens": plan["prompt_tokens"],
+            "completion_tokens": len(pieces),
+            "total_tokens": plan["prompt_tokens"] + len(pieces),
+            "prompt_tokens_details": {"cached_tokens": plan["cached_tokens"]},
+        }
+
+    def complete(self, body, plan):
+        pieces = self.token_pieces(plan)
+        time.sleep(len(pieces) / self.server.profile["tokens_per_second"])
+        message = {"role": "assistant", "content": ""}
+        for field, text in pieces:
+            message[field] = message.get(field, "") + text
+        self.send_json(
+            200,
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+                "usage": self.usage(plan, pieces),
+            },
+        )
+
+    def stream(self, body, plan):
+        """Server-sent events, one chunk per token, paced at tokens_per_second"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices, **extra):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": choices,
+                **extra,
+            }
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        pieces = self.token_pieces(plan)
+        interval = 1.0 / self.server.profile["tokens_per_second"]
+        start = time.monotonic()
+        try:
+            for n, (field, text) in enumerate(pieces):
+                # Sleep to the schedule rather than per token, so pacing holds
+                # even when the sleep granularity exceeds one token interval
+                delay = start + n * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                event([{"index": 0, "delta": {field: text}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                event([], usage=self.usage(plan, pieces))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (early stop on a complete answer)
+            with self.server.lock:
+                self.server.stats["closed_early"] += 1
+
+
+def median_sigma(value):
+    """argparse type for a lognormal given as MEDIAN,SIGMA"""
+    try:
+        median, sigma = (float(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected MEDIAN,SIGMA, got {value!r}")
+    return median, sigma
+
+
+if __name__ == "__main__":
+    # Usage: python mock_server.py --port 18001 --profile realistic
+    # then point host_list in predict.py at http://127.0.0.1:18001/v1
+    parser = argparse.ArgumentParser(
+        description="Mock OpenAI-compatible server for load testing predict.py"
+    )
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--malformed-rate", type=float)
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--reasoning-style", choices=["field", "inline", "none"])
+    parser.add_argument("--prefill-tokens-per-second", type=float)
+    parser.add_argument(
+        "--ttft",
+        type=median_sigma,
+        metavar="MEDIAN,SIGMA",
+        help="time to first token in seconds, e.g. 0.3,0.5",
+    )
+    parser.add_argument(
+        "--reasoning-tokens",
+        type=median_sigma,
+        metavar="MEDIAN,SIGMA",
+        help="reasoning tokens before the answer, e.g. 400,0.8",
+    )
+    parser.add_argument(
+        "--trailing-tokens",
+        type=int,
+        metavar="N",
+        help="tokens of prose after the answer",
+    )
+    parser.add_argument(
+        "--no-prefix-cache",
+        dest="prefix_cache",
+        action="store_const",
+        const=False,
+        help="disable the simulated prefix (KV) cache",
+    )
+    args = parser.parse_args()
+
+    profile = dict(PROFILES[args.profile])
+    for option in (
+        "error_rate",
+        "malformed_rate",
+        "tokens_per_second",
+        "reasoning_style",
+        "prefill_tokens_per_second",
+        "prefix_cache",
+        "ttft",
+        "reasoning_tokens",
+        "trailing_tokens",
+    ):
+        if getattr(args, option) is not None:
+            profile[option] = getattr(args, option)
+
+    server = MockServer(args.port, profile=profile, seed=args.seed, host=args.host)
+    print(f"Mock server ({args.profile}) on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.report()
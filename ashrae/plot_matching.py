@@ -1,9 +1,16 @@
+import io
 import os
 import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from contextlib import redirect_stdout
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from matplotlib.collections import PolyCollection
 from matplotlib.gridspec import GridSpec
 
 
@@ -169,61 +176,112 @@ class HeatmapPlotter:
         return True
 
     def _prepare_matrix_data(self, df, model_name):
-        """Prepare matrix data (ensure length matches target size, mark black positions)"""
+        """Lay the records out row-major on the matrix_shape grid of tiles
+
+        Up to rows * cols records get a tile each. Beyond that, the records
+        are split into rows * cols runs of consecutive records (sizes differ
+        by at most one), so every tile is used, each reduced to their mean
+        difference (over the records that are not black-marked), match rate
+        and fraction of black-marked records, so the grid stays the same size
+        whatever the record count. Tiles after the last record hold none.
+
+        Returns the match rate, mean difference (nan if no valid record),
+        invalid fraction and record count of each tile as rows x cols arrays.
+        """
         rows, cols = self.config["matrix_shape"]
         target_size = rows * cols
-
-        # 1. Process string matching results (integer type)
-        match_values = df["string_match"].astype(int).values
-        # Pad or truncate: ensure length = target_size
-        if len(match_values) < target_size:
-            pad_length = target_size - len(match_values)
-            match_values = np.pad(
-                match_values, (0, pad_length), "constant", constant_values=0
-            )
-            print(
-                f"[{model_name}] Insufficient matching data, padded {pad_length} zeros (original {len(match_values)-pad_length} → target {target_size})"
+        num_records = len(df)
+        if num_records > target_size:
+            starts = np.linspace(0, num_records, target_size + 1).astype(int)[:-1]
+        else:
+            starts = np.arange(num_records)
+
+        # Sum each tile's run of consecutive records in place, without
+        # padding or copying the columns; tiles past the last record stay 0
+        records = np.zeros(target_size, dtype=np.int64)
+        invalid = np.zeros(target_size, dtype=np.int64)
+        matches = np.zeros(target_size, dtype=np.int64)
+        diff_sum = np.zeros(target_size)
+        if num_records:
+            tiles = len(starts)
+            is_black = df["is_black"].to_numpy(dtype=bool)
+            records[:tiles] = np.diff(starts, append=num_records)
+            invalid[:tiles] = np.add.reduceat(is_black, starts, dtype=np.int64)
+            matches[:tiles] = np.add.reduceat(
+                df["string_match"].to_numpy(dtype=bool), starts, dtype=np.int64
             )
-        elif len(match_values) > target_size:
-            match_values = match_values[:target_size]
-            print(
-                f"[{model_name}] Excessive matching data, truncated to {target_size} entries (original {len(match_values)} → target {target_size})"
+            # MODIFICATION 3: Black-marked records (nan or out of range) never
+            # count towards the difference; a tile without a valid record is
+            # nan, which is rendered black
+            diff_sum[:tiles] = np.add.reduceat(
+                np.where(is_black, 0.0, df["float_diff"].to_numpy(float)), starts
             )
+        valid = records - invalid
 
-        # 2. Process float difference results (with black marking)
-        float_diff_values = df["float_diff"].values
-        # MODIFICATION 2: Get special condition marking array
-        is_black_values = df["is_black"].astype(bool).values
-
-        # First pad/truncate both the difference array and black marking array
-        # Process difference array
-        if len(float_diff_values) < target_size:
-            pad_length = target_size - len(float_diff_values)
-            float_diff_values = np.pad(
-                float_diff_values, (0, pad_length), "constant", constant_values=0
-            )
-            # Synchronously pad black marking array (mark padded parts as False, no black coloring)
-            is_black_values = np.pad(
-                is_black_values, (0, pad_length), "constant", constant_values=False
-            )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            float_diff_values = np.where(valid > 0, diff_sum / valid, np.nan)
+            match_values = np.where(records > 0, matches / records, 0.0)
+            invalid_values = np.where(records > 0, invalid / records, 0.0)
+
+        if num_records > target_size:
             print(
-                f"[{model_name}] Insufficient diff data, padded {pad_length} zeros (original {len(float_diff_values)-pad_length} → target {target_size})"
+                f"[{model_name}] {num_records} records aggregated into {target_size} tiles of {records.min()}-{records.max()} (mean difference, match rate and invalid fraction per tile)"
             )
-        elif len(float_diff_values) > target_size:
-            float_diff_values = float_diff_values[:target_size]
-            is_black_values = is_black_values[:target_size]
+        empty = int((records == 0).sum())
+        if empty:
             print(
-                f"[{model_name}] Excessive diff data, truncated to {target_size} entries (original {len(float_diff_values)} → target {target_size})"
+                f"[{model_name}] {empty} of {target_size} tiles left empty after the last record"
             )
 
-        # MODIFICATION 3: Set values at special condition positions to np.nan (invalid value)
-        # nan will be recognized as "bad" value by matplotlib, which can be rendered as black later
-        float_diff_values = np.where(is_black_values, np.nan, float_diff_values)
+        # Reshape into matrices
+        return (
+            match_values.reshape(rows, cols),
+            float_diff_values.reshape(rows, cols),
+            invalid_values.reshape(rows, cols),
+            records.reshape(rows, cols),
+        )
 
-        # Reshape into matrix
-        match_matrix = match_values.reshape(rows, cols)
-        float_diff_matrix = float_diff_values.reshape(rows, cols)
-        return match_matrix, float_diff_matrix
+    def _draw_match_outlines(self, ax, match_matrix, float_diff_matrix):
+        """Outline every non-nan cell, white if the strings match, black if not
+        (grey in between for the match rate of an aggregated tile)
+
+        All outlines are one PolyCollection: the same closed unit squares, in
+        the same (row-major) order and style as one Rectangle patch per cell,
+        so they render identically but as one artist instead of rows * cols.
+        """
+        x, y = np.nonzero(~np.isnan(float_diff_matrix))
+        corners = np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]])
+        verts = np.stack([y, x], axis=1)[:, None, :] + corners
+        edge_colors = np.repeat(match_matrix[x, y, None], 3, axis=1)
+        ax.add_collection(
+            PolyCollection(
+                verts,
+                facecolors="none",
+                edgecolors=edge_colors,
+                linewidths=self.config["rect_linewidth"],
+                joinstyle="miter",
+                capstyle="butt",
+            )
+        )
+
+    def _draw_match_outlines_loop(self, ax, match_matrix, float_diff_matrix):
+        """One Rectangle patch per cell, as plot() used to draw the outlines"""
+        rows, cols = self.config["matrix_shape"]
+        for x in range(rows):
+            for y in range(cols):
+                # Skip contours for nan values (optional, to avoid visual clutter on black areas)
+                if not np.isnan(float_diff_matrix[x, y]):
+                    edge_color = "white" if match_matrix[x, y] == 1 else "black"
+                    ax.add_patch(
+                        plt.Rectangle(
+                            (y - 0.5, x - 0.5),
+                            1,
+                            1,
+                            fill=False,
+                            edgecolor=edge_color,
+                            linewidth=self.config["rect_linewidth"],
+                        )
+                    )
 
     def plot(self):
         """Generate heatmaps with dynamic layout matching CSV count"""
@@ -273,7 +331,13 @@ class HeatmapPlotter:
             model_name = self.model_names[i]
 
             # Prepare matrix data
-            match_matrix, float_diff_matrix = self._prepare_matrix_data(df, model_name)
+            match_matrix, float_diff_matrix, invalid_matrix, records_matrix = (
+                self._prepare_matrix_data(df, model_name)
+            )
+            aggregated = records_matrix.max() > 1
+            empty_alpha = None
+            if (records_matrix == 0).any():
+                empty_alpha = (records_matrix > 0).astype(float)
 
             # MODIFICATION 4: Configure colormap to render nan (bad values) as black
             cmap = plt.cm.coolwarm.copy()
@@ -286,10 +350,22 @@ class HeatmapPlotter:
                 aspect="auto",
                 vmin=self.global_vmin,
                 vmax=self.global_vmax,
+                # Tiles after the last record stay blank
+                alpha=empty_alpha,
             )
+            if aggregated:
+                # Darken aggregated tiles by their fraction of black-marked records
+                overlay = np.zeros(invalid_matrix.shape + (4,))
+                overlay[..., 3] = invalid_matrix
+                ax.imshow(overlay, aspect="auto")
 
             # Subplot style
-            ax.set_title(model_name, pad=self.config["title_pad"])
+            title = model_name
+            if aggregated:
+                low, high = records_matrix.min(), records_matrix.max()
+                per_tile = f"{low}" if low == high else f"{low}-{high}"
+                title = f"{model_name} ({per_tile} records per tile)"
+            ax.set_title(title, pad=self.config["title_pad"])
             ax.set_xticklabels([])
             ax.set_yticklabels([])
             ax.set_xlabel("")
@@ -299,23 +375,8 @@ class HeatmapPlotter:
                 spine.set_visible(False)
             ax.tick_params(axis="both", which="both", length=0)
 
-            # Add matching result contours (original logic remains unchanged; black areas are not affected by contours)
-            rows, cols = self.config["matrix_shape"]
-            for x in range(rows):
-                for y in range(cols):
-                    # Skip contours for nan values (optional, to avoid visual clutter on black areas)
-                    if not np.isnan(float_diff_matrix[x, y]):
-                        edge_color = "white" if match_matrix[x, y] == 1 else "black"
-                        ax.add_patch(
-                            plt.Rectangle(
-                                (y - 0.5, x - 0.5),
-                                1,
-                                1,
-                                fill=False,
-                                edgecolor=edge_color,
-                                linewidth=self.config["rect_linewidth"],
-                            )
-                        )
+            # Add matching result contours (black areas are not affected by contours)
+            self._draw_match_outlines(ax, match_matrix, float_diff_matrix)
 
         # Add colorbar (span all rows in last column)
         cbar_ax = fig.add_subplot(gs[:, 2])
@@ -337,7 +398,108 @@ class HeatmapPlotter:
         self._restore_stdout()
 
 
+# ===================== Equivalence Check and Benchmark =====================
+def _synthetic_plotter(num_models, num_records, config=None, seed=0):
+    """HeatmapPlotter holding random results in the layout load_data() gives"""
+    rng = np.random.default_rng(seed)
+    plotter = HeatmapPlotter(config=config)
+    for idx in range(num_models):
+        float_diff = rng.normal(0, 1, num_records)
+        plotter.dataframes.append(
+            pd.DataFrame(
+                {
+                    "string_match": rng.random(num_records) < 0.6,
+                    "float_diff": float_diff,
+                    "is_black": rng.random(num_records) < 0.03,
+                }
+            )
+        )
+        plotter.model_names.append(f"model_{idx}")
+    plotter.global_vmin, plotter.global_vmax = -3, 3
+    return plotter
+
+
+def _render(num_models, num_records, config, loop=False):
+    """Seconds plot() takes, and the path of the saved figure"""
+    # plot() restores sys.stdout to what it was when the plotter was made;
+    # tight_layout warns about the colorbar axes on every figure
+    with redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        plotter = _synthetic_plotter(num_models, num_records, config)
+        if loop:
+            plotter._draw_match_outlines = plotter._draw_match_outlines_loop
+        start = time.perf_counter()
+        plotter.plot()
+        elapsed = time.perf_counter() - start
+    return elapsed, config["output_filename"]
+
+
+def check_equivalence(num_models=3):
+    """The collection must give the same pixels as the Rectangle patches"""
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        for loop in (True, False):
+            config = {"output_filename": os.path.join(tmp, f"loop_{loop}.png")}
+            images.append(plt.imread(_render(num_models, 8100, config, loop)[1]))
+        assert images[0].shape == images[1].shape
+        assert np.array_equal(images[0], images[1])
+    print(f"Equivalence check passed: identical {images[0].shape} images")
+
+
+def benchmark(model_counts=(1, 2, 4, 6), side_lengths=(30, 60, 90, 120)):
+    """plot() time with one Rectangle per cell and with one collection per
+    panel, as the models and the records (side_length**2 per model) grow"""
+    print(
+        f"=== Rendering heatmaps at {HeatmapPlotter.DEFAULT_CONFIG['figure_dpi']} dpi ==="
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for side in side_lengths:
+            for num_models in model_counts:
+                config = {
+                    "matrix_shape": (side, side),
+                    "output_filename": os.path.join(tmp, "heatmaps.png"),
+                }
+                timings = [
+                    _render(num_models, side * side, config, loop)[0]
+                    for loop in (True, False)
+                ]
+                print(
+                    f"   - {num_models} models x {side * side:>5} records: "
+                    f"patches {timings[0]:.2f}s, collection {timings[1]:.2f}s "
+                    f"({timings[0] / timings[1]:.1f}x)"
+                )
+
+
+def benchmark_record_counts(
+    record_counts=(8_100, 100_000, 1_000_000, 4_000_000), num_models=2
+):
+    """plot() time, and peak allocations of the tiling, as the records per
+    model grow past the matrix_shape budget"""
+    print(f"=== Rendering {num_models} models, tiles aggregated past 8100 records ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {"output_filename": os.path.join(tmp, "heatmaps.png")}
+        for num_records in record_counts:
+            elapsed = _render(num_models, num_records, config)[0]
+            with redirect_stdout(io.StringIO()):
+                plotter = _synthetic_plotter(1, num_records, config)
+                tracemalloc.start()
+                plotter._prepare_matrix_data(plotter.dataframes[0], "model_0")
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            print(
+                f"   - {num_records:>9} records: plot {elapsed:.2f}s, tiling peak "
+                f"{peak / 2**20:.1f} MB per model"
+            )
+
+
 if __name__ == "__main__":
+    # Usage: python plot_matching.py [--benchmark]
+    if "--benchmark" in sys.argv:
+        check_equivalence()
+        benchmark()
+        benchmark_record_counts()
+        sys.exit()
+
     # Example: Customize title padding (optional)
     custom_config = {
         "title_pad": 1,  # Adjust as needed; smaller values mean tighter title spacing
@@ -0,0 +1,127 @@
+import time
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+# ===================== 1. ASHRAE 7-Point Scale =====================
+PMV_CATEGORIES = [
+    "cold",
+    "cool",
+    "slightly cool",
+    "neutral",
+    "slightly warm",
+    "warm",
+    "hot",
+]
+# Boundaries between consecutive categories; each bin is left-closed, so a
+# PMV of exactly -0.5 is neutral and one of 2.5 is hot
+PMV_THRESHOLDS = [-2.5, -1.5, -0.5, 0.5, 1.5, 2.5]
+# Ordinal score of each category: cold -3 ... neutral 0 ... hot +3
+PMV_SCORES = {category: score for score, category in enumerate(PMV_CATEGORIES, -3)}
+
+
+def pmv_rules_text():
+    """The scale as the prose rules given to the LLM"""
+    lines = [f"- PMV < {PMV_THRESHOLDS[0]:g}: {PMV_CATEGORIES[0]}"]
+    for low, high, category in zip(
+        PMV_THRESHOLDS, PMV_THRESHOLDS[1:], PMV_CATEGORIES[1:]
+    ):
+        lines.append(f"- {low:g} ≤ PMV < {high:g}: {category}")
+    lines.append(f"- PMV ≥ {PMV_THRESHOLDS[-1]:g}: {PMV_CATEGORIES[-1]}")
+    return "\n".join(lines)
+
+
+# ===================== 2. Binning =====================
+def pmv_category(pmv):
+    """Category of each PMV value as an ordered Categorical (a Series with the
+    same index if pmv is a Series); NaN stays missing"""
+    values = np.asarray(pmv, dtype=float)
+    codes = np.digitize(values, PMV_THRESHOLDS)
+    codes[np.isnan(values)] = -1
+    categories = pd.Categorical.from_codes(codes, PMV_CATEGORIES, ordered=True)
+    if isinstance(pmv, pd.Series):
+        return pd.Series(categories, index=pmv.index, name=pmv.name)
+    return categories
+
+
+def category_of(value):
+    """Category of a single PMV value"""
+    return PMV_CATEGORIES[bisect_right(PMV_THRESHOLDS, value)]
+
+
+def category_score(labels):
+    """Ordinal score (see PMV_SCORES) of each label; NaN if not a category"""
+    codes = pd.Categorical(labels, categories=PMV_CATEGORIES).codes
+    return np.where(codes >= 0, codes - 3.0, np.nan)
+
+
+# ===================== 3. Equivalence Check and Benchmark =====================
+def _category_loop(pmv):
+    """The per-row loop assemble_original_prediction_pmv.py used to run"""
+    df_pmv = pd.DataFrame({"PMV_float_base": pmv, "PMV_string_base": None})
+    for i in range(0, len(df_pmv["PMV_float_base"])):
+        if df_pmv.loc[i, "PMV_float_base"] < -2.5:
+            df_pmv.loc[i, "PMV_string_base"] = "cold"
+        elif df_pmv.loc[i, "PMV_float_base"] < -1.5:
+            df_pmv.loc[i, "PMV_string_base"] = "cool"
+        elif df_pmv.loc[i, "PMV_float_base"] < -0.5:
+            df_pmv.loc[i, "PMV_string_base"] = "slightly cool"
+        elif df_pmv.loc[i, "PMV_float_base"] < 0.5:
+            df_pmv.loc[i, "PMV_string_base"] = "neutral"
+        elif df_pmv.loc[i, "PMV_float_base"] < 1.5:
+            df_pmv.loc[i, "PMV_string_base"] = "slightly warm"
+        elif df_pmv.loc[i, "PMV_float_base"] < 2.5:
+            df_pmv.loc[i, "PMV_string_base"] = "warm"
+        else:
+            df_pmv.loc[i, "PMV_string_base"] = "hot"
+    return df_pmv["PMV_string_base"]
+
+
+def check_equivalence(num_rows=20_000, seed=0):
+    """Vectorized binning must match the loop, pd.cut and category_of,
+    including values exactly on the thresholds"""
+    rng = np.random.default_rng(seed)
+    pmv = np.concatenate(
+        [rng.uniform(-4, 4, num_rows), np.round(rng.uniform(-4, 4, num_rows), 1)]
+    )
+    pmv = pd.Series(np.concatenate([pmv, PMV_THRESHOLDS]))
+    labels = pmv_category(pmv).astype(str)
+    assert labels.equals(_category_loop(pmv).astype(str))
+    bins = [-np.inf] + PMV_THRESHOLDS + [np.inf]
+    cut = pd.cut(pmv, bins, labels=PMV_CATEGORIES, right=False).astype(str)
+    assert labels.equals(cut)
+    assert labels.tolist() == [category_of(value) for value in pmv]
+    assert (category_score(labels) == np.digitize(pmv, PMV_THRESHOLDS) - 3).all()
+    assert pmv_category(pd.Series([np.nan])).isna().all()
+    print(f"Equivalence check passed on {len(pmv)} values")
+
+
+def benchmark(num_rows=5_000_000, loop_rows=20_000, seed=0):
+    """Rows per second of each way of binning PMV values"""
+    pmv = pd.Series(np.random.default_rng(seed).uniform(-4, 4, num_rows))
+    bins = [-np.inf] + PMV_THRESHOLDS + [np.inf]
+    methods = {
+        "loop with .loc": (lambda: _category_loop(pmv[:loop_rows]), loop_rows),
+        "np.digitize": (lambda: pmv_category(pmv), num_rows),
+        "pd.cut": (
+            lambda: pd.cut(pmv, bins, labels=PMV_CATEGORIES, right=False),
+            num_rows,
+        ),
+        "category_score": (lambda: category_score(pmv_category(pmv)), num_rows),
+    }
+    print(f"=== Binning {num_rows} PMV values ===")
+    for name, (method, rows) in methods.items():
+        start = time.perf_counter()
+        method()
+        elapsed = time.perf_counter() - start
+        print(
+            f"   - {name:>15}: {elapsed:.3f}s for {rows} rows "
+            f"({rows / elapsed:,.0f} rows/s, ~{elapsed * num_rows / rows:.1f}s "
+            f"for all {num_rows})"
+        )
+
+
+if __name__ == "__main__":
+    check_equivalence()
+    benchmark()
@@ -1,166 +1,102 @@
-import json
+import argparse
+import asyncio
+import hashlib
 import os
-import re
 import time
+from collections import Counter
 from pathlib import Path
 
 import openai
 import pandas as pd
 
-# ===================== 1. Define Column Description Dictionary =====================
-column_descriptions = {
-    # Metadata Columns
-    "building_id": "Unique building identifier [integer]. Note: some building IDs are inferred - see building_id_inf in metadata table",
-    "building_id_inf": "Flag indicating if unique building identifier was from original data source [no] or inferred [yes] from unique groupings of publication, country, city, season, building type, and cooling type",
-    "contributor": "Principal contact person regarding the data",
-    "publication": "Published paper describing the project from where the data was collected",
-    "region": "Region of field study",
-    "country": "Country of field study",
-    "city": "City of field study",
-    "lat": "Latitude of city [°]",
-    "lon": "Longitude of city [°]",
-    "climate": "Type of climate according to Köppen climate classification",
-    "building_type": "Type of building [office, multifamily housing, classroom, senior center, other]",
-    "cooling_type": "Cooling strategy of building [air conditioned, mixed mode, naturally ventilated]",
-    "year": "Year of field study [yyyy]",
-    "records": "Number of records for that building ID",
-    "has_age": "Flag indicating if there age was recorded [yes, no] and if it was a categorical variable in the original data source [categorical]",
-    "has_ec": "Flag indicating if environmental controls were in the original data source [yes, no]",
-    "has_timestamp": "Flag indicating if measurement timestamp was in the original data source [yes, no]",
-    "timezone": "IANA time zone of field study",
-    "met_source": "Source of meteorological data for t_out and rh_out [ghcn_d = from GHCN-D, original_data = from original data source; rp884 = from RP884 database]",
-    "isd_station": "ISD station code for t_out_isd, rh_out_isd and t_mot_isd",
-    "isd_distance": "Estimated distance of ISD station to city of field study [km]",
-    "database": "Version of database when data source was added [1, 2, 2.1]",
-    "quality_assurance": "Flag indicating if dataset from contributor passed automated quality assurance check [pass, fail]",
-    # Measurements Columns
-    "timestamp": "Timestamp of measurement [yyyy-mm-dd]",
-    "season": "Season measurement was made [summer, winter, hot/wet, cool/dry]. Note: based on the following assumptions when timestamp and location are known: northern hemisphere latitudes <20 are hot/wet from May-Oct and cool/dry from Nov-Apr; northern hemisphere latitudes >=20 are summer May-Oct and winter from Nov-Apr; vice versa for Southern Hemisphere",
-    "subject_id": "Unique subject identifier for future studies with repeat samples [integer]",
-    "age": "Age of subject [years]. Note: some studies used age ranges instead of years - see has_age in metadata table",
-    "gender": "Gender of subject [female, male]",
-    "ht": "Height of subject [m]",
-    "wt": "Weight of subject [kg]",
-    "ta": "Air temperature measured in the occupied zone [°C]",
-    "ta_h": "Air temperature measured at 1.1 m above the floor [°C]",
-    "ta_m": "Air temperature measured at 0.6 m above the floor [°C]",
-    "ta_l": "Air temperature measured at 0.1 m above the floor [°C]",
-    "top": "Operative temperature calculated for the occupied zone [°C]",
-    "tr": "Radiant temperature measured in the occupied zone [°C]",
-    "tg": "Globe temperature measured in the occupied zone [°C]",
-    "tg_h": "Globe temperature measured at 1.1 m above the floor [°C]",
-    "tg_m": "Globe temperature measured at 0.6 m above the floor [°C]",
-    "tg_l": "Globe temperature measured at 0.1 m above the floor [°C]",
-    "rh": "Relative humidity [%]",
-    "vel": "Air speed measured in the occupied zone [m/s]",
-    "vel_h": "Air speed measured at 1.1 m above the floor [m/s]",
-    "vel_m": "Air speed measured at 0.6 m above the floor [m/s]",
-    "vel_l": "Air speed measured at 0.1 m above the floor [m/s]",
-    "vel_r": "Relative air speed used to calculate the PMV [m/s]",
-    "met": "Average metabolic rate of the subject [met]",
-    "clo": "Intrinsic clothing ensemble insulation of the subject [clo]",
-    "clo_d": "Dynamic clothing, used to calculate the PMV [clo]",
-    "activity_10": "Average metabolic rate of the subject in the last 10 minutes [met]",
-    "activity_20": "Average metabolic rate of the subject in the last 20 minutes [met]",
-    "activity_30": "Average metabolic rate of the subject in the last 30 minutes [met]",
-    "activity_60": "Average metabolic rate of the subject in the last 60 minutes [met]",
-    "thermal_sensation": "Vote on the ASHRAE thermal sensation scale [-3 (cold) to 0 (neutral) +3 (hot)]",
-    "pmv": "Predicted mean vote, calculated in compliance with the ISO 7730",
-    "pmv_ce": "Predicted mean vote, calculated in compliance with the ASHRAE 55 2020",
-    "ppd": "Predicted percentage dissatisfied [%] calculated in compliance with the ISO 7730",
-    "ppd_ce": "Predicted percentage dissatisfied [%] calculated in compliance with the ASHRAE 55 2020",
-    "set": "Standard effective temperature [°C]",
-    "thermal_acceptability": "Thermal acceptability [acceptable, unacceptable]",
-    "thermal_preference": "Thermal preference [cooler, no change, warmer]",
-    "thermal_comfort": "Thermal comfort [1 (very uncomfortable) to 6 (very comfortable)]",
-    "air_movement_acceptability": "Air movement acceptability [acceptable, unacceptable]",
-    "air_movement_preference": "Air movement preference [less, no change, more]",
-    "blind_curtain": "State of blinds or curtains [0 = open; 1 = closed]",
-    "fan": "State of fan [0 = off, 1 = on]",
-    "window": "State of window [0 = open, 1 = closed]",
-    "door": "State of doors [0 = open, 1 = closed]",
-    "heater": "State of heater [0 = off, 1 = on]",
-    "t_out": "Outdoor air temperature from original dataset [°C]",
-    "rh_out": "Outdoor relative humidity from original dataset [%]",
-    "t_out_isd": "Average daily outdoor air temperature from ISD [°C]",
-    "rh_out_isd": "Average relative humidity from ISD [%]",
-    "t_mot_isd": "Calculated 7-day running mean outdoor temperature [°C]",
-}
-
-# ===================== 2. Data Preparation =====================
-# Load data and preprocess
-df_measurements = pd.read_csv("./ashrae-db-II/measurements.csv", nrows=8100)
-df_measurements["t_out"] = df_measurements["t_out_combined"]
-df_measurements = df_measurements.drop(
-    columns=[
-        "t_out_combined",
-        "building_id",
-        "subject_id",
-        "building_id_inf",
-        "contributor",
-        "publication",
-        "year",
-        "records",
-        "has_age",
-        "has_ec",
-        "has_timestamp",
-        "timezone",
-        "met_source",
-        "isd_station",
-        "isd_distance",
-        "database",
-        "quality_assurance",
-        "thermal_sensation",
-        "pmv",
-        "pmv_ce",
-        "ppd",
-        "ppd_ce",
-        "set",
-        "thermal_acceptability",
-        "thermal_preference",
-        "thermal_comfort",
-    ]
+from dataset import read_measurements
+from host_dispatcher import HostDispatcher
+from pmv_scale import pmv_category, pmv_rules_text
+from rate_control import AIMDController, AttemptBudget, backoff_delay
+from response_cache import ResponseCache
+from response_parser import (
+    JsonObjectScanner,
+    load_json,
+    parse_batch_answers,
+    parse_pmv_answer,
+    validate_answer,
+    validate_batch,
 )
+from run_journal import RunJournal
+from sentences import RENDERERS, load_measurements
+from telemetry import RunMetrics
 
-# Generate descriptive sentences for each row (fixed value formatting)
-sentences = []
-for index, row in df_measurements.iterrows():
-    non_nan_pairs = [(col, value) for col, value in row.items() if pd.notna(value)]
-    sentence_parts = []
-
-    for col, value in non_nan_pairs:
-        # Get full column description
-        col_desc = column_descriptions.get(col, col)
-
-        # Value formatting (supports int/float)
-        if isinstance(value, int):
-            formatted_value = str(value)
-        elif isinstance(value, float):
-            formatted_value = str(int(value)) if value.is_integer() else f"{value:.2f}"
-        else:
-            formatted_value = str(value).strip()
 
-        sentence_parts.append(f"The {col_desc} is {formatted_value}.")
-
-    sentence = " ".join(sentence_parts)
-    sentences.append(sentence)
+# ===================== Command Line Options =====================
+def parse_shard(text):
+    """Parse "i/N" (0 <= i < N) into (i, N)"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {text!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{count - 1}")
+    return index, count
+
+
+# Record format: verbose English sentences (the original prompt), compact
+# key=value pairs or markdown table rows; the compact formats add a legend
+# of the columns once per prompt. Compare formats with sentences.py
+# (prompt tokens) and one run per format (telemetry and accuracy).
+#
+# Prompt layout: see PROMPT_LAYOUT below.
+#
+# Sharding: --shard i/N evaluates every N-th record starting at record i, with
+# its own journal and prediction file; merge_shards.py rebuilds the full
+# prediction file once every shard is done
+parser = argparse.ArgumentParser(description="Evaluate PMV predictions with LLMs")
+parser.add_argument(
+    "--shard",
+    type=parse_shard,
+    default=(0, 1),
+    help="evaluate shard i of N (0-based), e.g. --shard 0/4",
+)
+parser.add_argument(
+    "--prompt-layout",
+    choices=["original", "prefix"],
+    default="original",
+    help="prefix: invariant prompt parts first so servers can reuse their KV cache",
+)
+parser.add_argument(
+    "--record-format",
+    choices=sorted(RENDERERS),
+    default="verbose",
+    help="how each measurement record is written into the prompt",
+)
+args = parser.parse_args()
+SHARD_INDEX, NUM_SHARDS = args.shard
+SHARD_SUFFIX = f".shard-{SHARD_INDEX}-of-{NUM_SHARDS}" if NUM_SHARDS > 1 else ""
+
+# ===================== 1-2. Data Preparation =====================
+# Column descriptions, dropped columns and the record renderers live in sentences.py
+MEASUREMENTS_PATH = "./ashrae-db-II/measurements.csv"
+NUM_RECORDS = 8100
+df_measurements = load_measurements(MEASUREMENTS_PATH, nrows=NUM_RECORDS)
+
+# Render each row in the chosen record format (fixed value formatting)
+RECORD_FORMAT = args.record_format
+renderer = RENDERERS[RECORD_FORMAT]
+sentences = renderer.render(df_measurements)
+record_legend = renderer.legend(df_measurements)
 
 # Save to new DataFrame
 questions = pd.DataFrame({"sentences": sentences})
 
 # ===================== 3. LLM Configuration =====================
-prompt = """
+# The thresholds come from pmv_scale, which also scores the answers
+pmv_rules = f"""
 Evaluate the thermal sensation using the Predicted Mean Vote (PMV) scale. 
 Fill in missing information based on your assumptions if needed.
 PMV scale rules:
-- PMV < -2.5: cold
-- -2.5 ≤ PMV < -1.5: cool
-- -1.5 ≤ PMV < -0.5: slightly cool
-- -0.5 ≤ PMV < 0.5: neutral
-- 0.5 ≤ PMV < 1.5: slightly warm
-- 1.5 ≤ PMV < 2.5: warm
-- PMV ≥ 2.5: hot
+{pmv_rules_text()}
+"""
 
+output_format = """
 Return ONLY a valid JSON object with exactly these two keys:
 1. "P_float": PMV value (float between -3 and 3)
 2. "P_string": PMV category (one of: cold, cool, slightly cool, neutral, slightly warm, warm, hot)
@@ -168,6 +104,108 @@ Return ONLY a valid JSON object with exactly these two keys:
 Your output must be a single JSON object wrapped in ```JSON``` markers.
 """
 
+prompt = pmv_rules + output_format
+
+# Batch mode packs BATCH_SIZE records into one request (async mode only); the
+# answers are wrapped in an object because response_format=json_object does not
+# allow a top-level array. BATCH_SIZE = 1 keeps one request per record.
+BATCH_SIZE = 1
+
+batch_output_format = """
+Return ONLY a valid JSON object with exactly one key "results": an array of exactly {count} objects,
+one per record in the order given. Each object has exactly these two keys:
+1. "P_float": PMV value (float between -3 and 3)
+2. "P_string": PMV category (one of: cold, cool, slightly cool, neutral, slightly warm, warm, hot)
+
+Your output must be a single JSON object wrapped in ```JSON``` markers.
+"""
+
+system_message = "keep the answers clean and neat."  # Fixed typo: net -> neat
+
+question_template = """
+        Previous tasks finished. New task, based on the following thermal comfort measurements, describe your thermal sensation with PMV:
+        {sentence}
+        
+        {prompt}
+        """
+
+batch_question_template = """
+        Previous tasks finished. New task, based on the following thermal comfort measurements of {count} different people, describe the thermal sensation of each person with PMV:
+        {records}
+        
+        {prompt}
+        """
+
+
+# Prompt layout. "original" sends the record ahead of the PMV rules, so no two
+# requests share more than the opening sentence. "prefix" moves every
+# invariant part (system message, PMV rules, output schema, record legend)
+# into the system message and sends only the record in the user message,
+# giving all requests one long common prefix that the prefix (KV) caches of
+# vLLM and llama.cpp reuse. The telemetry reports the cached share of prompt
+# tokens where the server returns it; comparing TTFT of a run per layout
+# (e.g. against mock_server.py) gives the latency gain.
+PROMPT_LAYOUT = args.prompt_layout
+
+prefix_question_template = """
+Previous tasks finished. New task, based on the following thermal comfort measurements, describe your thermal sensation with PMV:
+{sentence}
+"""
+
+prefix_batch_question_template = """
+Previous tasks finished. New task, based on the following thermal comfort measurements of {count} different people, describe the thermal sensation of each person with PMV ({count} results):
+{records}
+"""
+
+# Same schema as batch_output_format without the per-request count, which
+# would otherwise break the shared prefix
+prefix_batch_output_format = """
+Return ONLY a valid JSON object with exactly one key "results": an array with exactly one object
+per record, in the order given. Each object has exactly these two keys:
+1. "P_float": PMV value (float between -3 and 3)
+2. "P_string": PMV category (one of: cold, cool, slightly cool, neutral, slightly warm, warm, hot)
+
+Your output must be a single JSON object wrapped in ```JSON``` markers.
+"""
+
+
+def prefix_system_message(instructions):
+    """System message of the prefix layout: every invariant part of the prompt"""
+    return "\n".join(filter(None, [system_message, instructions, record_legend]))
+
+
+if PROMPT_LAYOUT == "prefix":
+    single_system_message = prefix_system_message(prompt)
+    batch_system_message = prefix_system_message(pmv_rules + prefix_batch_output_format)
+else:
+    single_system_message = batch_system_message = system_message
+
+
+def prompt_version(*texts):
+    return hashlib.sha256("".join(texts).encode("utf-8")).hexdigest()[:12]
+
+
+# Journal entries are keyed by prompt version, so editing any prompt text
+# starts a fresh set of results instead of mixing old and new answers
+SINGLE_PROMPT_VERSION = prompt_version(
+    system_message, question_template, prompt, record_legend
+)
+BATCH_PROMPT_VERSION = prompt_version(
+    system_message,
+    batch_question_template,
+    pmv_rules,
+    batch_output_format,
+    str(BATCH_SIZE),
+    record_legend,
+)
+if PROMPT_LAYOUT == "prefix":
+    SINGLE_PROMPT_VERSION = prompt_version(
+        single_system_message, prefix_question_template
+    )
+    BATCH_PROMPT_VERSION = prompt_version(
+        batch_system_message, prefix_batch_question_template, str(BATCH_SIZE)
+    )
+
 MAX_NUM_TOKENS = 10240
 llm_list = [
     "mistral-small3.2",
@@ -185,124 +223,634 @@ host_list = [
 ]
 server_url = host_list[0]  # Fixed typo: sever_url -> server_url
 
-# Create temporary folders
-Path("./temp").mkdir(parents=True, exist_ok=True)
+# Async mode sends up to MAX_CONCURRENCY requests per host at once instead of
+# one request per record followed by a fixed sleep, spread over every host_list entry
+ASYNC_MODE = True
+MAX_CONCURRENCY = 16
+
+# Sync mode sends one record per request whatever BATCH_SIZE is, so its results
+# are journaled and cached under the single-record prompt version
+BATCH_MODE = ASYNC_MODE and BATCH_SIZE > 1
+PROMPT_VERSION = BATCH_PROMPT_VERSION if BATCH_MODE else SINGLE_PROMPT_VERSION
+
+# Sweep mode evaluates every model in sweep_models in one process: the prompts
+# are built once and all models run concurrently (async mode only), writing
+# one prediction file per model
+SWEEP_MODE = False
+sweep_models = llm_list
+# Models only served by specific hosts; every other model uses host_list
+model_hosts = {}
+
+models = sweep_models if SWEEP_MODE else [llm_model]
+
+# Adaptive concurrency (async mode): each model's in-flight window starts at
+# MAX_CONCURRENCY and moves between 1 and MAX_CONCURRENCY per host, growing
+# additively while latency is stable and halving on errors or queueing delay.
+# False keeps the window fixed at MAX_CONCURRENCY per host.
+ADAPTIVE_CONCURRENCY = True
+
+# Total LLM calls per record, shared by transport retries (with jittered
+# exponential backoff) and parse retries (re-asked immediately)
+MAX_ATTEMPTS_PER_RECORD = 6
+
+# Streaming mode (async only): read completions as they are generated and close
+# the request as soon as a complete, valid {P_float, P_string} answer arrives
+STREAM_MODE = False
+# Per-model cap on streamed thinking tokens; a reply still thinking at the cap
+# is cut off and handled like an unusable answer (re-asked within the budget)
+thinking_token_caps = {}
+
+
+def model_slug(model):
+    return model.replace(":", "-")
+
+
+def output_name(model):
+    """File stem of the model's journal and prediction file (per record
+    format, prompt layout and shard)"""
+    fmt = f".{RECORD_FORMAT}" if RECORD_FORMAT != "verbose" else ""
+    layout = f".{PROMPT_LAYOUT}" if PROMPT_LAYOUT != "original" else ""
+    return model_slug(model) + fmt + layout + SHARD_SUFFIX
+
+
+# Create output folders
 Path("./prediction").mkdir(parents=True, exist_ok=True)
 Path("./assembled").mkdir(parents=True, exist_ok=True)
 
-# Initialize OpenAI client
+# Per-record results are appended to the run journal (one per model); a restarted
+# run skips every record the journal already holds a successful result for
+journals = {
+    model: RunJournal(f"./journal/{output_name(model)}.jsonl") for model in models
+}
+
+# Identical requests (same model, messages, temperature, seed, max_tokens, ...)
+# are answered from the on-disk cache instead of the server
+USE_RESPONSE_CACHE = True
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+response_cache = ResponseCache("./cache/responses.sqlite", max_bytes=MAX_CACHE_BYTES)
+
+# Outcome counts of the response parser (clean, repaired, invalid, no_json)
+parse_stats = Counter()
+
+# Initialize OpenAI client (serial loop) and one host dispatcher per model (async
+# engine), since latency and health are tracked per model
 client = openai.OpenAI(
     base_url=server_url,  # Updated variable name
     api_key="tceval",
 )
+dispatchers = {
+    model: HostDispatcher(model_hosts.get(model, host_list), api_key="tceval")
+    for model in models
+}
+controllers = {}
+
+# Per-request telemetry: one CSV row per LLM call in ./metrics/ and a
+# percentile summary per model at the end of the run. Set METRICS_PORT to
+# also serve live Prometheus text-format metrics on /metrics
+METRICS_PORT = None
+run_metrics = RunMetrics(
+    f"./metrics/run-{time.strftime('%Y%m%d-%H%M%S')}{SHARD_SUFFIX}.csv"
+)
+if METRICS_PORT:
+    run_metrics.serve(METRICS_PORT)
 
 
 # ===================== 4. Core Functions =====================
-def get_llm_response(client, user_message, temperature=0.4, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
+def build_request_kwargs(model, user_message, temperature, system=system_message):
+    """Keyword arguments shared by the sync and async chat completion calls"""
+    return dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": user_message},
+        ],
+        temperature=temperature,
+        max_tokens=MAX_NUM_TOKENS,
+        n=1,
+        stop=None,
+        seed=0,
+        # Non-standard server option, must travel in the request body
+        extra_body={"enable_thinking": True},  # set to false to disable thinking prompt
+        response_format={"type": "json_object"},
+    )
+
+
+def get_llm_response(
+    client,
+    model,
+    user_message,
+    budget,
+    temperature=0.4,
+    use_cache=USE_RESPONSE_CACHE,
+    system=system_message,
+):
+    """use_cache=False skips the cache lookup (used when re-asking after a bad
+    answer); the fresh response still replaces the cached one. Every call to
+    the server spends one attempt from the record's budget."""
+    kwargs = build_request_kwargs(model, user_message, temperature, system)
+    cache_key = response_cache.make_key(kwargs)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    while budget.spend():
+        start = time.monotonic()
         try:
-            response = client.chat.completions.create(
-                model=llm_model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "keep the answers clean and neat.",  # Fixed typo: net -> neat
-                    },
-                    {"role": "user", "content": user_message},
-                ],
-                temperature=temperature,
-                max_tokens=MAX_NUM_TOKENS,
-                n=1,
-                stop=None,
-                seed=0,
-                enable_thinking=True,  # set to false to disable thinking prompt
-                response_format={"type": "json_object"},
+            response = client.chat.completions.create(**kwargs)
+            content = response.choices[0].message.content
+        except Exception as e:
+            run_metrics.record(
+                model,
+                server_url,
+                start,
+                retry=budget.attempts - 1,
+                status="error",
+                latency=time.monotonic() - start,
+            )
+            budget.transport_errors += 1
+            print(
+                f"API call failed (attempt {budget.attempts}/{budget.max_attempts}): {str(e)}"
+            )
+            time.sleep(backoff_delay(budget.transport_errors - 1))
+            continue
+        run_metrics.record(
+            model,
+            server_url,
+            start,
+            retry=budget.attempts - 1,
+            stop="finished",
+            latency=time.monotonic() - start,
+            **completion_usage(response),
+        )
+        response_cache.put(cache_key, content)
+        return content
+    raise Exception(f"Attempt budget of {budget.max_attempts} calls exhausted")
+
+
+def completion_usage(response):
+    """Token counts reported by the server (None where it reports nothing)"""
+    usage = getattr(response, "usage", None)
+    # Prefix (KV) cache hits, reported by e.g. vLLM and llama.cpp
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens if usage else None,
+        "cached_tokens": getattr(details, "cached_tokens", None),
+        "completion_tokens": usage.completion_tokens if usage else None,
+    }
+
+
+async def stream_completion(client, kwargs, validate, thinking_cap=None):
+    """Stream one completion and stop reading once the answer is complete
+
+    Returns (content, stop, usage) where stop is "answer" (a valid object
+    arrived and the request was closed early), "thinking_cap" (the model was
+    still thinking at the cap and the request was closed) or "finished".
+    Reasoning is recognized both as a separate reasoning delta and as an
+    inline <think> block; objects inside the reasoning are never accepted.
+    usage holds the time to first token and the token counts (streamed
+    chunks unless the server reports usage at the end of the stream).
+    """
+    start = time.monotonic()
+    stream = await client.chat.completions.create(
+        **kwargs, stream=True, stream_options={"include_usage": True}
+    )
+    scanner = JsonObjectScanner()
+    content = ""
+    chunks = thinking = 0
+    in_think = think_done = False
+    stop = "finished"
+    usage = dict(completion_usage(None), ttft=None)
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                usage.update(completion_usage(chunk))
+            if not chunk.choices:
+                continue
+            if usage["ttft"] is None:
+                usage["ttft"] = time.monotonic() - start
+            chunks += 1
+            delta = chunk.choices[0].delta
+            text = delta.content or ""
+            reasoning = getattr(delta, "reasoning_content", None) or getattr(
+                delta, "reasoning", None
+            )
+            content += text
+
+            # Tags may be split across chunks, so look slightly behind
+            window = content[-(len(text) + 8) :]
+            if not think_done and not in_think and "<think>" in window:
+                in_think = True
+            if in_think and "</think>" in window:
+                in_think, think_done = False, True
+                text = content[content.index("</think>") + len("</think>") :]
+
+            if reasoning or in_think:
+                thinking += 1
+                if thinking_cap is not None and thinking > thinking_cap:
+                    stop = "thinking_cap"
+                    break
+                continue
+
+            for candidate in scanner.feed(text):
+                loaded, _ = load_json(candidate)
+                if validate(loaded) is not None:
+                    stop = "answer"
+                    break
+            if stop == "answer":
+                break
+    finally:
+        await stream.close()
+    if usage["completion_tokens"] is None:
+        usage["completion_tokens"] = chunks
+    return content, stop, usage
+
+
+async def get_llm_response_async(
+    dispatcher,
+    controller,
+    model,
+    user_message,
+    budget,
+    temperature=0.4,
+    use_cache=USE_RESPONSE_CACHE,
+    system=system_message,
+    validate=validate_answer,
+):
+    """Async counterpart of get_llm_response; each retry is re-dispatched,
+    so work from a failing host moves to the other hosts, and every call
+    holds a slot of the model's concurrency window. In streaming mode the
+    request ends as soon as validate accepts an object in the reply."""
+    kwargs = build_request_kwargs(model, user_message, temperature, system)
+    cache_key = response_cache.make_key(kwargs)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    call = {"host": None}  # Filled in with the host that serves the request
+
+    async def request(client):
+        call["host"] = str(client.base_url).rstrip("/")
+        if STREAM_MODE:
+            return await stream_completion(
+                client, kwargs, validate, thinking_token_caps.get(model)
             )
-            return response.choices[0].message.content
+        response = await client.chat.completions.create(**kwargs)
+        usage = dict(completion_usage(response), ttft=None)
+        return response.choices[0].message.content, "finished", usage
+
+    while budget.spend():
+        call["host"] = None
+        queued = time.monotonic()
+        await controller.acquire()
+        start = time.monotonic()
+        try:
+            content, stop, usage = await dispatcher.submit(request)
         except Exception as e:
-            retry_count += 1
-            print(f"API call failed (retry {retry_count}/{max_retries}): {str(e)}")
-            time.sleep(1)
-    raise Exception(f"Maximum retry limit {max_retries} reached, API call failed")
+            error = e
+        else:
+            error = None
+        finally:
+            controller.release()
+        elapsed = time.monotonic() - start
+        run_metrics.record(
+            model,
+            call["host"],
+            queued,
+            retry=budget.attempts - 1,
+            status="ok" if error is None else "error",
+            stop=stop if error is None else None,
+            queue_wait=start - queued,
+            latency=elapsed,
+            **(usage if error is None else {}),
+        )
+
+        if error is None:
+            controller.on_success(elapsed)
+            # A reply cut off while thinking holds no answer worth replaying
+            if stop != "thinking_cap":
+                response_cache.put(cache_key, content)
+            return content
+
+        # Transport error: shrink the window and back off outside of it
+        controller.on_failure()
+        budget.transport_errors += 1
+        print(
+            f"API call failed (attempt {budget.attempts}/{budget.max_attempts}): {str(error)}"
+        )
+        await asyncio.sleep(backoff_delay(budget.transport_errors - 1))
+    raise Exception(f"Attempt budget of {budget.max_attempts} calls exhausted")
+
+
+def with_legend(records):
+    """Put the record format's legend (if any) ahead of the records"""
+    return f"{record_legend}\n{records}" if record_legend else records
+
+
+def build_user_question(i):
+    if PROMPT_LAYOUT == "prefix":
+        return prefix_question_template.format(sentence=questions["sentences"][i])
+    return question_template.format(
+        sentence=with_legend(questions["sentences"][i]), prompt=prompt
+    )
 
 
-def extract_json_between_markers(llm_output):
-    json_pattern = r"```(?:json|JSON)(.*?)```"
-    matches = re.findall(json_pattern, llm_output, re.DOTALL)
+def build_batch_question(batch_ids):
+    records = "\n        ".join(
+        f"Record {n}: {questions['sentences'][i]}"
+        for n, i in enumerate(batch_ids, start=1)
+    )
+    if PROMPT_LAYOUT == "prefix":
+        return prefix_batch_question_template.format(
+            count=len(batch_ids), records=records
+        )
+    return batch_question_template.format(
+        count=len(batch_ids),
+        records=with_legend(records),
+        prompt=pmv_rules + batch_output_format.format(count=len(batch_ids)),
+    )
 
-    if not matches:
-        json_pattern = r"\{[\s\S]*\}"
-        matches = re.findall(json_pattern, llm_output, re.DOTALL)
 
-    for json_string in matches:
-        json_string = json_string.strip()
-        try:
-            return json.loads(json_string)
-        except json.JSONDecodeError:
-            try:
-                json_clean = re.sub(r"[\x00-\x1F\x7F]", "", json_string)
-                json_clean = json_clean.replace("'", '"')
-                return json.loads(json_clean)
-            except:
-                continue
+def save_record(model, i, result, status="ok"):
+    """Append single record result (PMV fields only) to the model's run journal"""
+    journals[model].append(i, model, PROMPT_VERSION, result, status=status)
 
-    return None
 
+def process_record(model, i):
+    budget = AttemptBudget(MAX_ATTEMPTS_PER_RECORD)
+    try:
+        print(f"[{model}] Processing PMV evaluation for record {i}...")
+        user_question = build_user_question(i)
+
+        pmv_response = get_llm_response(
+            client,
+            model,
+            user_question,
+            budget,
+            temperature=0.4,
+            system=single_system_message,
+        )
+        pmv_json = parse_pmv_answer(pmv_response, parse_stats)
+
+        # Retry JSON parsing while the record has attempts left
+        while pmv_json is None and budget.remaining > 0:
+            budget.parse_errors += 1
+            print(f"JSON parsing failed, retrying {budget.parse_errors}...")
+            pmv_response = get_llm_response(
+                client,
+                model,
+                user_question,
+                budget,
+                temperature=0.4,
+                use_cache=False,
+                system=single_system_message,
+            )
+            pmv_json = parse_pmv_answer(pmv_response, parse_stats)
+        if pmv_json is None:
+            raise Exception("No valid PMV answer within the attempt budget")
 
-# ===================== 5. Main Execution Logic (Index Removed) =====================
-start_idx = 0
-end_idx = len(questions["sentences"])
-all_results = []
+        # Extract results (index removed)
+        result = {
+            "PMV_float": pmv_json.get("P_float"),
+            "PMV_string": pmv_json.get("P_string"),
+        }
+        print(f"[{model}] Record {i} processed successfully: {result}")
+        save_record(model, i, result)
 
-for i in range(start_idx, end_idx):
-    try:
-        print(f"Processing PMV evaluation for record {i}...")  # Progress print only
-        user_question = f"""
-        Previous tasks finished. New task, based on the following thermal comfort measurements, describe your thermal sensation with PMV:
-        {questions['sentences'][i]}
-        
-        {prompt}
-        """
+    except Exception as e:
+        print(f"[{model}] Error processing record {i}: {str(e)}")
+        result = {"PMV_float": None, "PMV_string": None}
+        save_record(model, i, result, status="error")
 
-        pmv_response = get_llm_response(client, user_question, temperature=0.4)
-        pmv_json = extract_json_between_markers(pmv_response)
+    return result
 
-        # Retry JSON parsing
-        retry_count = 0
-        while pmv_json is None and retry_count < 3:
-            print(f"JSON parsing failed, retrying {retry_count+1}...")
-            pmv_response = get_llm_response(client, user_question, temperature=0.4)
-            pmv_json = extract_json_between_markers(pmv_response)
-            retry_count += 1
 
-        # Extract results (index removed)
+async def process_record_async(model, i):
+    """Same flow as process_record; requests wait for a slot in the model's
+    concurrency window"""
+    dispatcher, controller = dispatchers[model], controllers[model]
+    budget = AttemptBudget(MAX_ATTEMPTS_PER_RECORD)
+    try:
+        print(f"[{model}] Processing PMV evaluation for record {i}...")
+        user_question = build_user_question(i)
+
+        pmv_response = await get_llm_response_async(
+            dispatcher,
+            controller,
+            model,
+            user_question,
+            budget,
+            temperature=0.4,
+            system=single_system_message,
+        )
+        pmv_json = parse_pmv_answer(pmv_response, parse_stats)
+
+        # Parse errors are re-asked right away: the server is healthy, so
+        # there is no backoff and the window is left alone
+        while pmv_json is None and budget.remaining > 0:
+            budget.parse_errors += 1
+            print(
+                f"[{model}] JSON parsing failed for record {i}, retrying {budget.parse_errors}..."
+            )
+            pmv_response = await get_llm_response_async(
+                dispatcher,
+                controller,
+                model,
+                user_question,
+                budget,
+                temperature=0.4,
+                use_cache=False,
+                system=single_system_message,
+            )
+            pmv_json = parse_pmv_answer(pmv_response, parse_stats)
+        if pmv_json is None:
+            raise Exception("No valid PMV answer within the attempt budget")
+
         result = {
             "PMV_float": pmv_json.get("P_float"),
             "PMV_string": pmv_json.get("P_string"),
         }
-        all_results.append(result)
-        print(f"Record {i} processed successfully: {result}")
+        print(f"[{model}] Record {i} processed successfully: {result}")
 
-        # Save single record result (PMV fields only)
-        temp_df = pd.DataFrame([result])
-        temp_df.to_csv(f"./temp/temp_df_{i}.csv", index=False)
+    except Exception as e:
+        print(f"[{model}] Error processing record {i}: {str(e)}")
+        result = {"PMV_float": None, "PMV_string": None}
+        status = "error"
+    else:
+        status = "ok"
+
+    save_record(model, i, result, status=status)
+    return result
 
-        time.sleep(0.5)
 
+async def process_batch_async(model, batch_ids):
+    """Evaluate several records with one request; records the batch reply does
+    not answer with a valid object are split off and retried one request each"""
+    try:
+        print(f"[{model}] Processing PMV evaluation for records {batch_ids}...")
+        pmv_response = await get_llm_response_async(
+            dispatchers[model],
+            controllers[model],
+            model,
+            build_batch_question(batch_ids),
+            AttemptBudget(MAX_ATTEMPTS_PER_RECORD),
+            temperature=0.4,
+            system=batch_system_message,
+            validate=lambda loaded: validate_batch(loaded, len(batch_ids)),
+        )
+        answers = parse_batch_answers(pmv_response, len(batch_ids), parse_stats)
     except Exception as e:
-        print(f"Error processing record {i}: {str(e)}")
-        result = {"PMV_float": None, "PMV_string": None}
-        temp_df = pd.DataFrame([result])
-        temp_df.to_csv(f"./temp/temp_df_{i}.csv", index=False)
-        continue
-
-# Final save of all results (no index)
-if all_results:
-    final_df = pd.DataFrame(all_results)
-    final_df.to_csv(f"./prediction/{llm_model.replace(':', '-')}.csv", index=False)
+        print(f"[{model}] Error processing records {batch_ids}: {str(e)}")
+        answers = None
+
+    if answers is None:
+        print(f"[{model}] Batch {batch_ids} unusable, retrying record by record")
+        answers = [None] * len(batch_ids)
+
+    retry_ids = []
+    for i, answer in zip(batch_ids, answers):
+        if answer is None:
+            retry_ids.append(i)
+            continue
+        result = {"PMV_float": answer["P_float"], "PMV_string": answer["P_string"]}
+        save_record(model, i, result)
+
+    await asyncio.gather(*(process_record_async(model, i) for i in retry_ids))
+
+
+async def run_async(model, record_ids, max_concurrency=MAX_CONCURRENCY):
+    """Evaluate records concurrently (results are written to the journal)"""
+    # Created inside the event loop that uses it
+    limit = max_concurrency * len(dispatchers[model].hosts)
+    controllers[model] = AIMDController(
+        initial=max_concurrency if ADAPTIVE_CONCURRENCY else limit,
+        maximum=limit,
+        adaptive=ADAPTIVE_CONCURRENCY,
+    )
+    start = time.monotonic()
+    if BATCH_SIZE > 1:
+        batches = [
+            record_ids[n : n + BATCH_SIZE]
+            for n in range(0, len(record_ids), BATCH_SIZE)
+        ]
+        await asyncio.gather(*(process_batch_async(model, batch) for batch in batches))
+    else:
+        await asyncio.gather(*(process_record_async(model, i) for i in record_ids))
+    elapsed = time.monotonic() - start
+
+    requests = sum(host.completed + host.failed for host in dispatchers[model].hosts)
     print(
-        f"All records processed. Final results saved to {llm_model.replace(':', '-')}.csv"
+        f"[{model}] {len(record_ids)} records in {elapsed:.1f}s "
+        f"({len(record_ids) / elapsed if elapsed else 0:.2f} records/s, "
+        f"{requests} requests, batch size {BATCH_SIZE})"
     )
+
+
+async def run_sweep_async(pending_ids):
+    """Run every model at once so their wall-clock time overlaps"""
+    await asyncio.gather(*(run_async(model, pending_ids[model]) for model in models))
+
+
+def pending_records(model, record_ids):
+    done = journals[model].completed(model, PROMPT_VERSION)
+    pending = [i for i in record_ids if i not in done]
+    print(
+        f"[{model}] Prompt version {PROMPT_VERSION}: {len(record_ids) - len(pending)} "
+        f"records already in journal, {len(pending)} to process"
+    )
+    return pending
+
+
+def report_batch_drift(model, record_ids):
+    """Compare batch-mode answers with single-record answers for the same records"""
+    batched = pd.DataFrame(journals[model].results(model, PROMPT_VERSION, record_ids))
+    single = pd.DataFrame(
+        journals[model].results(model, SINGLE_PROMPT_VERSION, record_ids)
+    )
+    both = batched["PMV_string"].notna() & single["PMV_string"].notna()
+    if not both.any():
+        print(f"[{model}] No single-record results in the journal to compare against")
+        return
+    string_agreement = (batched["PMV_string"] == single["PMV_string"])[both].mean()
+    float_drift = (
+        pd.to_numeric(batched["PMV_float"], errors="coerce")
+        - pd.to_numeric(single["PMV_float"], errors="coerce")
+    )[both].abs()
+    print(
+        f"[{model}] Batch vs single-record mode on {both.sum()} records: "
+        f"PMV_string agreement {string_agreement:.4f}, "
+        f"mean |PMV_float difference| {float_drift.mean():.4f}"
+    )
+
+
+def report_accuracy(model, record_ids):
+    """Agreement with the ISO 7730 PMV of each record: exact category match and
+    |PMV difference| < 1, over all records (unanswered ones count as misses)"""
+    pmv = read_measurements(MEASUREMENTS_PATH, ["pmv"], nrows=NUM_RECORDS)["pmv"]
+    pmv = pmv.iloc[record_ids].reset_index(drop=True)
+    truth = pmv_category(pmv).astype(str)
+    results = pd.DataFrame(journals[model].results(model, PROMPT_VERSION, record_ids))
+    predicted = pd.to_numeric(results["PMV_float"], errors="coerce")
+    print(
+        f"[{model}] Accuracy ({RECORD_FORMAT} records): "
+        f"{results['PMV_string'].notna().mean():.4f} answered, "
+        f"exact match {(results['PMV_string'] == truth).mean():.4f}, "
+        f"|PMV diff| < 1 {((predicted - pmv).abs() < 1).mean():.4f}"
+    )
+
+
+def save_predictions(model, record_ids):
+    """Final save of all results (no index), one sequential read of the journal;
+    failed records keep their row as empty fields. A shard's file is written
+    even without a valid answer, so merge_shards.py still finds its records"""
+    all_results = journals[model].results(model, PROMPT_VERSION, record_ids)
+    journals[model].close()
+    if not any(result["PMV_float"] is not None for result in all_results):
+        print(f"[{model}] No valid data was processed")
+        if NUM_SHARDS == 1:
+            return
+    final_df = pd.DataFrame(all_results, columns=["PMV_float", "PMV_string"])
+    if NUM_SHARDS > 1:
+        # Shard files carry the record id so merge_shards.py can check them
+        final_df.insert(0, "record", record_ids)
+    final_df.to_csv(f"./prediction/{output_name(model)}.csv", index=False)
+    print(
+        f"[{model}] All records processed. Final results saved to {output_name(model)}.csv"
+    )
+
+
+# ===================== 5. Main Execution Logic (Index Removed) =====================
+start_idx = 0
+end_idx = len(questions["sentences"])
+# Record r belongs to shard r % NUM_SHARDS
+record_ids = [i for i in range(start_idx, end_idx) if i % NUM_SHARDS == SHARD_INDEX]
+if NUM_SHARDS > 1:
+    print(f"Shard {SHARD_INDEX}/{NUM_SHARDS}: {len(record_ids)} records")
+
+pending_ids = {model: pending_records(model, record_ids) for model in models}
+
+if ASYNC_MODE:
+    asyncio.run(run_sweep_async(pending_ids))
+    for model in models:
+        dispatchers[model].report(label=model)
+        controllers[model].report(label=model)
 else:
-    print("No valid data was processed")
+    for model in models:
+        for i in pending_ids[model]:
+            process_record(model, i)
+for model in models:
+    run_metrics.report(model)
+run_metrics.close()
+
+for model in models:
+    if BATCH_MODE:
+        report_batch_drift(model, record_ids)
+    report_accuracy(model, record_ids)
+    save_predictions(model, record_ids)
+response_cache.report()
+response_cache.close()
+print(
+    f"Response parser: {parse_stats['clean']} clean, {parse_stats['repaired']} repaired, "
+    f"{parse_stats['invalid']} invalid, {parse_stats['no_json']} without JSON"
+)
@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import random
+import time
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class AttemptBudget:
+    """Total number of LLM calls one record may use, shared by transport
+    retries (server or network errors) and parse retries (unusable replies)"""
+
+    def __init__(self, max_attempts):
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.transport_errors = 0
+        self.parse_errors = 0
+
+    @property
+    def remaining(self):
+        return self.max_attempts - self.attempts
+
+    def spend(self):
+        """Use one attempt; False when the budget is exhausted"""
+        if self.attempts >= self.max_attempts:
+            return False
+        self.attempts += 1
+        return True
+
+
+class AIMDController:
+    """Adaptive concurrency window (additive increase / multiplicative decrease)
+
+    Up to int(window) requests may be in flight. Each successful request
+    grows the window by increase / window, i.e. by about `increase` per
+    window-full of requests. A transport error, or a short-term smoothed
+    latency above latency_tolerance times the long-term baseline (queueing
+    on the server), multiplies the window by decrease. Decreases are spaced
+    at least one smoothed latency apart, so a burst of failures from the same
+    overload counts once. With adaptive=False the window stays fixed and this
+    acts as a semaphore.
+    """
+
+    def __init__(
+        self,
+        initial=4,
+        minimum=1,
+        maximum=64,
+        increase=1.0,
+        decrease=0.5,
+        latency_tolerance=2.0,
+        smoothing=0.1,
+        baseline_smoothing=0.01,
+        adaptive=True,
+    ):
+        self.window = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+        self.peak_window = self.window
+        self._waiters = collections.deque()
+
+    def _wake(self):
+        """Hand free slots to waiting requests in arrival order"""
+        while self._waiters and self.in_flight < int(self.window):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < int(self.window):
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A slot handed over just before cancellation must be given back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency or 0.0):
+            return
+        self.last_decrease = now
+        self.window = max(self.minimum, self.window * self.decrease)
+
+    def on_success(self, latency):
+        if self.latency is None:
+            self.latency = self.baseline_latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+            self.baseline_latency += self.baseline_smoothing * (
+                latency - self.baseline_latency
+            )
+        if not self.adaptive:
+            return
+        if self.latency > self.latency_tolerance * self.baseline_latency:
+            self._decrease()
+        else:
+            self.window = min(self.maximum, self.window + self.increase / self.window)
+            self.peak_window = max(self.peak_window, self.window)
+            self._wake()
+
+    def on_failure(self):
+        if self.adaptive:
+            self._decrease()
+
+    def report(self, label=None):
+        latency = f"{self.latency:.2f}s" if self.latency is not None else "n/a"
+        print(
+            f"\n=== Concurrency Control{f' ({label})' if label else ''} ===\n"
+            f"   - Window: {self.window:.1f} (peak {self.peak_window:.1f}, "
+            f"limits {self.minimum}-{self.maximum}) | Smoothed latency: {latency}"
+        )
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+
+class ResponseCache:
+    """Persistent, size-bounded LRU cache of LLM responses
+
+    Entries are content-addressed by a SHA-256 hash of the full request
+    (model, message list, temperature, seed, max_tokens and the remaining
+    request options), so only an identical request can be answered from the
+    cache. When the stored responses exceed max_bytes the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(request_kwargs):
+        """Hash of the request; key order and whitespace do not matter"""
+        payload = json.dumps(request_kwargs, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response or None, refreshing its LRU position"""
+        row = self.conn.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, response):
+        """Store (or replace) a response and evict old entries if over budget"""
+        size = len(response.encode("utf-8"))
+        old = self.conn.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, size, last_used) "
+            "VALUES (?, ?, ?, ?)",
+            (key, response, size, time.time()),
+        )
+        self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits max_bytes"""
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_used ASC"
+        )
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def report(self):
+        """Print hit statistics for this run"""
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        print("\n=== Response Cache Summary ===")
+        print(
+            f"   - Lookups: {lookups} | Hits: {self.hits} | Misses: {self.misses} "
+            f"| Hit rate: {hit_rate:.2%}"
+        )
+        print(
+            f"   - Evictions: {self.evictions} | Size: "
+            f"{self.total_bytes / 1024 / 1024:.1f} / {self.max_bytes / 1024 / 1024:.0f} MB"
+        )
+
+    def close(self):
+        self.conn.close()
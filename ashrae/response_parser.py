@@ -0,0 +1,368 @@
+import json
+import math
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+from pmv_scale import PMV_CATEGORIES
+
+PMV_RANGE = (-3.0, 3.0)
+
+# Characters that change the scanner state; everything else is skipped in C
+_STRUCTURAL = re.compile(r'[{}"\\]')
+# Opening marker of a fenced JSON block, as in extract_json_between_markers
+_JSON_FENCE = re.compile(r"```(?:json|JSON)")
+
+
+# ===================== 1. Balanced JSON Object Scanner =====================
+class JsonObjectScanner:
+    """Incremental scanner for balanced {...} spans
+
+    Text can be fed in pieces (e.g. streamed tokens); each call to feed
+    returns the top-level objects completed by that piece. Braces inside
+    double-quoted strings are ignored. Objects nested in a brace that is
+    never closed (e.g. a stray "{" in a reasoning trace) are only known to
+    be top-level once the text has ended: finish returns them. Every
+    character is looked at once, so the scan is linear in the text length.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.open_braces = []  # Offsets of the braces not closed yet
+        self.nested = []  # Per open brace, the (start, end) of objects closed in it
+        self.in_string = False
+        self.skip_until = 0
+
+    @property
+    def depth(self):
+        return len(self.open_braces)
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        for match in _STRUCTURAL.finditer(self.text, self.pos):
+            pos = match.start()
+            if pos < self.skip_until:
+                continue
+            char = match.group()
+            if self.in_string:
+                if char == "\\":
+                    self.skip_until = pos + 2  # Escaped character
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = self.depth > 0 and self._opens_string(pos)
+            elif char == "{":
+                self.open_braces.append(pos)
+                self.nested.append([])
+            elif char == "}" and self.depth > 0:
+                start = self.open_braces.pop()
+                self.nested.pop()  # Inside this object, so not top-level
+                if self.open_braces:
+                    self.nested[-1].append((start, pos + 1))
+                else:
+                    completed.append(self.text[start : pos + 1])
+        # An escape at the very end of the chunk still applies to the next one
+        self.pos = max(len(self.text), self.skip_until)
+        return completed
+
+    def _opens_string(self, pos):
+        """A JSON string can only start after {, [, , or : (and whitespace);
+        quotes elsewhere are prose, e.g. a quoted word in a reasoning trace"""
+        before = pos - 1
+        while before >= 0 and self.text[before] in " \t\r\n":
+            before -= 1
+        return before >= 0 and self.text[before] in "{[,:"
+
+    def finish(self):
+        """Objects inside braces that were never closed, in text order"""
+        return [self.text[start:end] for spans in self.nested for start, end in spans]
+
+
+def iter_json_objects(text):
+    """Yield every top-level balanced {...} span of text in one left-to-right pass
+
+    An opening brace that is never closed (e.g. a stray "{" in a reasoning
+    trace) does not hide the complete objects after it: they are yielded
+    at the end of the pass.
+    """
+    scanner = JsonObjectScanner()
+    yield from scanner.feed(text)
+    yield from scanner.finish()
+
+
+def iter_fenced_blocks(text):
+    """Yield the content of each ```json ... ``` block of text, in order; an
+    unclosed last fence (e.g. a truncated reply) runs to the end of text"""
+    pos = 0
+    while True:
+        match = _JSON_FENCE.search(text, pos)
+        if match is None:
+            return
+        end = text.find("```", match.end())
+        if end < 0:
+            yield text[match.end() :]
+            return
+        yield text[match.end() : end]
+        pos = end + 3
+
+
+# ===================== 2. Repair Strategies =====================
+def _strip_control_chars(s):
+    return re.sub(r"[\x00-\x1F\x7F]", "", s)
+
+
+def _single_to_double_quotes(s):
+    return s.replace("'", '"')
+
+
+def _drop_trailing_commas(s):
+    return re.sub(r",\s*([}\]])", r"\1", s)
+
+
+def _quote_bare_keys(s):
+    return re.sub(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:", r'\1"\2":', s)
+
+
+def _drop_plus_signs(s):
+    return re.sub(r"([:\[,]\s*)\+(?=\d|\.\d)", r"\1", s)
+
+
+# Applied cumulatively: each stage also keeps the repairs before it
+REPAIRS = [
+    _strip_control_chars,
+    _single_to_double_quotes,
+    _drop_trailing_commas,
+    _quote_bare_keys,
+    _drop_plus_signs,
+]
+
+
+def load_json(candidate):
+    """Return (object, repaired) for a candidate span, (None, False) if hopeless"""
+    try:
+        return json.loads(candidate), False
+    except json.JSONDecodeError:
+        pass
+    for repair in REPAIRS:
+        candidate = repair(candidate)
+        try:
+            return json.loads(candidate), True
+        except json.JSONDecodeError:
+            continue
+    return None, False
+
+
+# ===================== 3. Schema Validation =====================
+def normalize_category(value):
+    """Map spelling variants such as "Slightly_Warm" onto the PMV vocabulary"""
+    if not isinstance(value, str):
+        return None
+    category = " ".join(
+        value.strip().lower().replace("_", " ").replace("-", " ").split()
+    )
+    return category if category in PMV_CATEGORIES else None
+
+
+def normalize_float(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value) or not PMV_RANGE[0] <= value <= PMV_RANGE[1]:
+        return None
+    return value
+
+
+def validate_answer(answer):
+    """Return {"P_float", "P_string"} with normalized values, or None"""
+    if not isinstance(answer, dict):
+        return None
+    p_float = normalize_float(answer.get("P_float"))
+    p_string = normalize_category(answer.get("P_string"))
+    if p_float is None or p_string is None:
+        return None
+    return {"P_float": p_float, "P_string": p_string}
+
+
+def validate_batch(loaded, count):
+    """Return count validated answers from {"results": [...]}, or None"""
+    if not isinstance(loaded, dict):
+        return None
+    answers = loaded.get("results")
+    if not isinstance(answers, list) or len(answers) != count:
+        return None
+    return [validate_answer(answer) for answer in answers]
+
+
+# ===================== 4. Response Parsers =====================
+def _first_valid(candidates, validate):
+    """Try candidates from the last one backwards (the final answer of a
+    reasoning trace comes after any drafts); the first valid answer and
+    whether it needed repairs"""
+    for candidate in reversed(candidates):
+        loaded, repaired = load_json(candidate)
+        answer = validate(loaded)
+        if answer is not None:
+            return answer, repaired
+    return None, False
+
+
+def _parse(llm_output, validate, stats):
+    """Return the first valid answer of the fenced ```json blocks, each scanned
+    on its own so an unclosed draft before it cannot hide it, else of the
+    whole text"""
+    if not llm_output:
+        if stats is not None:
+            stats["no_json"] += 1
+        return None
+    fenced = [
+        candidate
+        for block in iter_fenced_blocks(llm_output)
+        for candidate in iter_json_objects(block)
+    ]
+    answer, repaired = _first_valid(fenced, validate)
+    candidates = fenced
+    if answer is None:
+        candidates = list(iter_json_objects(llm_output))
+        answer, repaired = _first_valid(candidates, validate)
+    if stats is not None:
+        if answer is not None:
+            stats["repaired" if repaired else "clean"] += 1
+        else:
+            stats["invalid" if fenced or candidates else "no_json"] += 1
+    return answer
+
+
+def parse_pmv_answer(llm_output, stats=None):
+    """Parse a single-record reply into a validated {"P_float", "P_string"} dict
+
+    stats, if given, is a Counter that receives the outcome
+    (clean, repaired, invalid or no_json).
+    """
+    return _parse(llm_output, validate_answer, stats)
+
+
+def parse_batch_answers(llm_output, count, stats=None):
+    """Parse a batch reply {"results": [...]} into count validated answers
+
+    Returns None if no object with a results array of the right length is
+    found; individual answers that fail validation are None.
+    """
+
+    return _parse(llm_output, lambda loaded: validate_batch(loaded, count), stats)
+
+
+# ===================== 5. Recorded-Output Benchmark =====================
+# Replies that broke a parser before, with the answer parse_pmv_answer must give
+PARSER_CASES = [
+    (
+        '{"P_float": 0.5, "P_string": "neutral"}',
+        {"P_float": 0.5, "P_string": "neutral"},
+    ),
+    (
+        'Draft {"P_float": 1.2, "P_string": "slightly warm"} then a stray { and '
+        '```json\n{"P_float": -0.7, "P_string": "slightly cool"}\n```',
+        {"P_float": -0.7, "P_string": "slightly cool"},
+    ),
+    (
+        # An unclosed draft with an open string before the fenced answer
+        'Draft: {"P_float": 0.4, "P_string": "neut\nLet me redo.\n'
+        '```json\n{"P_float": 0.6, "P_string": "slightly warm"}\n```',
+        {"P_float": 0.6, "P_string": "slightly warm"},
+    ),
+    ("No answer here {", None),
+]
+
+
+def check_parsers():
+    """parse_pmv_answer must give the expected answer on every PARSER_CASES reply"""
+    for llm_output, expected in PARSER_CASES:
+        assert parse_pmv_answer(llm_output) == expected, llm_output
+    print(f"Parser check passed on {len(PARSER_CASES)} cases")
+
+
+def extract_json_between_markers(llm_output):
+    """Reference regex parser (original predict.py implementation)"""
+    json_pattern = r"```(?:json|JSON)(.*?)```"
+    matches = re.findall(json_pattern, llm_output, re.DOTALL)
+
+    if not matches:
+        json_pattern = r"\{[\s\S]*\}"
+        matches = re.findall(json_pattern, llm_output, re.DOTALL)
+
+    for json_string in matches:
+        json_string = json_string.strip()
+        try:
+            return json.loads(json_string)
+        except json.JSONDecodeError:
+            try:
+                json_clean = re.sub(r"[\x00-\x1F\x7F]", "", json_string)
+                json_clean = json_clean.replace("'", '"')
+                return json.loads(json_clean)
+            except:
+                continue
+
+    return None
+
+
+def export_corpus(cache_path="./cache/responses.sqlite", corpus_path="./corpus.jsonl"):
+    """Freeze the raw model outputs held in the response cache as a JSONL corpus"""
+    conn = sqlite3.connect(cache_path)
+    with open(corpus_path, "w", encoding="utf-8") as f:
+        for key, response in conn.execute("SELECT key, response FROM responses"):
+            f.write(json.dumps({"key": key, "response": response}) + "\n")
+        for i, (response, _) in enumerate(PARSER_CASES):
+            f.write(json.dumps({"key": f"case-{i}", "response": response}) + "\n")
+    conn.close()
+
+
+def benchmark(corpus_path="./corpus.jsonl", repeat=5):
+    """Compare parse time and re-query count of both parsers on recorded outputs"""
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        responses = [json.loads(line)["response"] for line in f]
+    print(f"Corpus: {len(responses)} recorded outputs from {corpus_path}")
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        legacy = [extract_json_between_markers(response) for response in responses]
+    legacy_time = (time.perf_counter() - start) / repeat
+
+    stats = Counter()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        stats.clear()
+        parsed = [parse_pmv_answer(response, stats) for response in responses]
+    new_time = (time.perf_counter() - start) / repeat
+
+    # Every None triggered (or triggers) one extra LLM call in the retry loop
+    legacy_requery = sum(answer is None for answer in legacy)
+    legacy_out_of_schema = sum(
+        answer is not None and validate_answer(answer) is None for answer in legacy
+    )
+    new_requery = sum(answer is None for answer in parsed)
+    print(
+        f"Legacy parser: {legacy_time * 1000:.1f} ms total, {legacy_requery} re-queries, "
+        f"{legacy_out_of_schema} accepted answers outside the PMV schema"
+    )
+    print(
+        f"Single-pass parser: {new_time * 1000:.1f} ms total, {new_requery} re-queries "
+        f"(clean {stats['clean']}, repaired {stats['repaired']}, "
+        f"invalid {stats['invalid']}, no JSON {stats['no_json']})"
+    )
+
+
+if __name__ == "__main__":
+    # Usage: python response_parser.py [corpus.jsonl]
+    # Without an argument the corpus is exported from the response cache first
+    check_parsers()
+    if len(sys.argv) > 1:
+        benchmark(sys.argv[1])
+    else:
+        export_corpus()
+        benchmark()
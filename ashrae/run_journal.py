@@ -0,0 +1,85 @@
+import json
+import os
+from pathlib import Path
+
+
+class RunJournal:
+    """Append-only JSONL log of per-record LLM results
+
+    Every processed record appends one line keyed by (record, model,
+    prompt_version). When a key appears more than once the last line wins,
+    so a retried record simply supersedes its earlier failure. A restarted
+    run reads the journal once to find which records are already done.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def read_entries(self, model, prompt_version):
+        """Return {record: entry} for one model and prompt version (last write wins)"""
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partial line left behind by an interrupted write
+                    continue
+                if (
+                    entry["model"] == model
+                    and entry["prompt_version"] == prompt_version
+                ):
+                    entries[entry["record"]] = entry
+        return entries
+
+    def last_entry(self):
+        """The last complete entry of the journal, None if it has none"""
+        last = None
+        if not self.path.exists():
+            return last
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    last = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partial line left behind by an interrupted write
+                    continue
+        return last
+
+    def completed(self, model, prompt_version):
+        """Records with a successful result that a restarted run can skip"""
+        return {
+            record
+            for record, entry in self.read_entries(model, prompt_version).items()
+            if entry["status"] == "ok"
+        }
+
+    def append(self, record, model, prompt_version, result, status="ok"):
+        """Durably append one record result"""
+        entry = {
+            "record": int(record),
+            "model": model,
+            "prompt_version": prompt_version,
+            "status": status,
+            **result,
+        }
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def results(
+        self, model, prompt_version, records, fields=("PMV_float", "PMV_string")
+    ):
+        """Results for records in the given order, empty fields for missing ones"""
+        entries = self.read_entries(model, prompt_version)
+        return [
+            {field: entries.get(record, {}).get(field) for field in fields}
+            for record in records
+        ]
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,362 @@
+import re
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+from dataset import read_measurements
+
+try:
+    import tiktoken
+except ImportError:  # Optional: exact token counts in benchmark_renderers
+    tiktoken = None
+
+# ===================== 1. Define Column Description Dictionary =====================
+column_descriptions = {
+    # Metadata Columns
+    "building_id": "Unique building identifier [integer]. Note: some building IDs are inferred - see building_id_inf in metadata table",
+    "building_id_inf": "Flag indicating if unique building identifier was from original data source [no] or inferred [yes] from unique groupings of publication, country, city, season, building type, and cooling type",
+    "contributor": "Principal contact person regarding the data",
+    "publication": "Published paper describing the project from where the data was collected",
+    "region": "Region of field study",
+    "country": "Country of field study",
+    "city": "City of field study",
+    "lat": "Latitude of city [°]",
+    "lon": "Longitude of city [°]",
+    "climate": "Type of climate according to Köppen climate classification",
+    "building_type": "Type of building [office, multifamily housing, classroom, senior center, other]",
+    "cooling_type": "Cooling strategy of building [air conditioned, mixed mode, naturally ventilated]",
+    "year": "Year of field study [yyyy]",
+    "records": "Number of records for that building ID",
+    "has_age": "Flag indicating if there age was recorded [yes, no] and if it was a categorical variable in the original data source [categorical]",
+    "has_ec": "Flag indicating if environmental controls were in the original data source [yes, no]",
+    "has_timestamp": "Flag indicating if measurement timestamp was in the original data source [yes, no]",
+    "timezone": "IANA time zone of field study",
+    "met_source": "Source of meteorological data for t_out and rh_out [ghcn_d = from GHCN-D, original_data = from original data source; rp884 = from RP884 database]",
+    "isd_station": "ISD station code for t_out_isd, rh_out_isd and t_mot_isd",
+    "isd_distance": "Estimated distance of ISD station to city of field study [km]",
+    "database": "Version of database when data source was added [1, 2, 2.1]",
+    "quality_assurance": "Flag indicating if dataset from contributor passed automated quality assurance check [pass, fail]",
+    # Measurements Columns
+    "timestamp": "Timestamp of measurement [yyyy-mm-dd]",
+    "season": "Season measurement was made [summer, winter, hot/wet, cool/dry]. Note: based on the following assumptions when timestamp and location are known: northern hemisphere latitudes <20 are hot/wet from May-Oct and cool/dry from Nov-Apr; northern hemisphere latitudes >=20 are summer May-Oct and winter from Nov-Apr; vice versa for Southern Hemisphere",
+    "subject_id": "Unique subject identifier for future studies with repeat samples [integer]",
+    "age": "Age of subject [years]. Note: some studies used age ranges instead of years - see has_age in metadata table",
+    "gender": "Gender of subject [female, male]",
+    "ht": "Height of subject [m]",
+    "wt": "Weight of subject [kg]",
+    "ta": "Air temperature measured in the occupied zone [°C]",
+    "ta_h": "Air temperature measured at 1.1 m above the floor [°C]",
+    "ta_m": "Air temperature measured at 0.6 m above the floor [°C]",
+    "ta_l": "Air temperature measured at 0.1 m above the floor [°C]",
+    "top": "Operative temperature calculated for the occupied zone [°C]",
+    "tr": "Radiant temperature measured in the occupied zone [°C]",
+    "tg": "Globe temperature measured in the occupied zone [°C]",
+    "tg_h": "Globe temperature measured at 1.1 m above the floor [°C]",
+    "tg_m": "Globe temperature measured at 0.6 m above the floor [°C]",
+    "tg_l": "Globe temperature measured at 0.1 m above the floor [°C]",
+    "rh": "Relative humidity [%]",
+    "vel": "Air speed measured in the occupied zone [m/s]",
+    "vel_h": "Air speed measured at 1.1 m above the floor [m/s]",
+    "vel_m": "Air speed measured at 0.6 m above the floor [m/s]",
+    "vel_l": "Air speed measured at 0.1 m above the floor [m/s]",
+    "vel_r": "Relative air speed used to calculate the PMV [m/s]",
+    "met": "Average metabolic rate of the subject [met]",
+    "clo": "Intrinsic clothing ensemble insulation of the subject [clo]",
+    "clo_d": "Dynamic clothing, used to calculate the PMV [clo]",
+    "activity_10": "Average metabolic rate of the subject in the last 10 minutes [met]",
+    "activity_20": "Average metabolic rate of the subject in the last 20 minutes [met]",
+    "activity_30": "Average metabolic rate of the subject in the last 30 minutes [met]",
+    "activity_60": "Average metabolic rate of the subject in the last 60 minutes [met]",
+    "thermal_sensation": "Vote on the ASHRAE thermal sensation scale [-3 (cold) to 0 (neutral) +3 (hot)]",
+    "pmv": "Predicted mean vote, calculated in compliance with the ISO 7730",
+    "pmv_ce": "Predicted mean vote, calculated in compliance with the ASHRAE 55 2020",
+    "ppd": "Predicted percentage dissatisfied [%] calculated in compliance with the ISO 7730",
+    "ppd_ce": "Predicted percentage dissatisfied [%] calculated in compliance with the ASHRAE 55 2020",
+    "set": "Standard effective temperature [°C]",
+    "thermal_acceptability": "Thermal acceptability [acceptable, unacceptable]",
+    "thermal_preference": "Thermal preference [cooler, no change, warmer]",
+    "thermal_comfort": "Thermal comfort [1 (very uncomfortable) to 6 (very comfortable)]",
+    "air_movement_acceptability": "Air movement acceptability [acceptable, unacceptable]",
+    "air_movement_preference": "Air movement preference [less, no change, more]",
+    "blind_curtain": "State of blinds or curtains [0 = open; 1 = closed]",
+    "fan": "State of fan [0 = off, 1 = on]",
+    "window": "State of window [0 = open, 1 = closed]",
+    "door": "State of doors [0 = open, 1 = closed]",
+    "heater": "State of heater [0 = off, 1 = on]",
+    "t_out": "Outdoor air temperature from original dataset [°C]",
+    "rh_out": "Outdoor relative humidity from original dataset [%]",
+    "t_out_isd": "Average daily outdoor air temperature from ISD [°C]",
+    "rh_out_isd": "Average relative humidity from ISD [%]",
+    "t_mot_isd": "Calculated 7-day running mean outdoor temperature [°C]",
+}
+
+
+# ===================== 2. Data Preparation =====================
+# Identifiers, bookkeeping and ground-truth columns never shown to the LLM
+DROPPED_COLUMNS = [
+    "t_out_combined",
+    "building_id",
+    "subject_id",
+    "building_id_inf",
+    "contributor",
+    "publication",
+    "year",
+    "records",
+    "has_age",
+    "has_ec",
+    "has_timestamp",
+    "timezone",
+    "met_source",
+    "isd_station",
+    "isd_distance",
+    "database",
+    "quality_assurance",
+    "thermal_sensation",
+    "pmv",
+    "pmv_ce",
+    "ppd",
+    "ppd_ce",
+    "set",
+    "thermal_acceptability",
+    "thermal_preference",
+    "thermal_comfort",
+]
+
+
+def load_measurements(measurements_path, nrows=None, columnar=True):
+    """Load measurements.csv and keep only the columns shown to the LLM
+
+    Dropped columns are never read; the typed Feather copy is used when
+    ashrae.py wrote one (see dataset.read_measurements).
+    """
+    df_measurements = read_measurements(
+        measurements_path,
+        columns=lambda col: col == "t_out_combined" or col not in DROPPED_COLUMNS,
+        nrows=nrows,
+        columnar=columnar,
+    )
+    df_measurements["t_out"] = df_measurements["t_out_combined"]
+    return df_measurements.drop(columns="t_out_combined")
+
+
+# ===================== 3. Sentence Builders =====================
+def format_value(value):
+    """Value formatting (supports int/float)"""
+    if isinstance(value, int):
+        return str(value)
+    elif isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:.2f}"
+    else:
+        return str(value).strip()
+
+
+def build_sentences_iterrows(df, column_descriptions):
+    """Reference row-by-row builder (original predict.py implementation)"""
+    sentences = []
+    for index, row in df.iterrows():
+        non_nan_pairs = [(col, value) for col, value in row.items() if pd.notna(value)]
+        sentence_parts = []
+
+        for col, value in non_nan_pairs:
+            # Get full column description
+            col_desc = column_descriptions.get(col, col)
+            sentence_parts.append(f"The {col_desc} is {format_value(value)}.")
+
+        sentence = " ".join(sentence_parts)
+        sentences.append(sentence)
+    return sentences
+
+
+def build_column_parts(series, make_part):
+    """Return make_part(formatted value) per row, "" where the value is NaN
+
+    Each distinct value is formatted once and scattered back to the rows by
+    its factorize code, so the cost scales with the number of unique values.
+    """
+    codes, uniques = pd.factorize(series)
+    parts = [make_part(format_value(value)) for value in uniques]
+    # Code -1 (missing value) picks the trailing empty string
+    parts.append("")
+    return np.array(parts, dtype=object)[codes]
+
+
+def build_sentences(df, column_descriptions):
+    """Column-wise sentence builder, same output as build_sentences_iterrows"""
+    column_parts = [
+        build_column_parts(
+            df[col],
+            lambda value, desc=column_descriptions.get(col, col): (
+                f"The {desc} is {value}."
+            ),
+        )
+        for col in df.columns
+    ]
+    return [" ".join(filter(None, parts)) for parts in zip(*column_parts)]
+
+
+# ===================== 4. Record Renderers =====================
+# Bracketed description suffixes that are formats or flags rather than units
+NON_UNITS = {"integer", "yyyy", "yyyy-mm-dd", "yes", "no", "categorical"}
+
+
+def column_unit(col_desc):
+    """Unit from a description such as "Air temperature ... [°C]", "" if none"""
+    for unit in reversed(re.findall(r"\[([^\]]+)\]", col_desc)):
+        if re.fullmatch(r"[^\s,;=]+", unit) and unit not in NON_UNITS:
+            return unit
+    return ""
+
+
+class RecordRenderer(ABC):
+    """Turns measurement rows into the per-record text shown to the LLM
+
+    render(df) returns one string per row. legend(df) returns text that is
+    shown once per prompt ahead of the records (column meanings or a table
+    header), "" if the records explain themselves.
+    """
+
+    name = None
+
+    def __init__(self, column_descriptions=column_descriptions):
+        self.column_descriptions = column_descriptions
+
+    def legend(self, df):
+        return ""
+
+    @abstractmethod
+    def render(self, df):
+        """One string per row of df"""
+
+
+class VerboseRenderer(RecordRenderer):
+    """One English sentence per non-null column (the original prompt format)"""
+
+    name = "verbose"
+
+    def render(self, df):
+        return build_sentences(df, self.column_descriptions)
+
+
+class KeyValueRenderer(RecordRenderer):
+    """Compact "ta=24.3 °C; rh=45 %" pairs for the non-null columns"""
+
+    name = "key_value"
+
+    def legend(self, df):
+        lines = [
+            f"{col}: {self.column_descriptions.get(col, col)}" for col in df.columns
+        ]
+        return "Keys used in the measurements:\n" + "\n".join(lines)
+
+    def render(self, df):
+        column_parts = []
+        for col in df.columns:
+            unit = column_unit(self.column_descriptions.get(col, col))
+            suffix = f" {unit}" if unit else ""
+            column_parts.append(
+                build_column_parts(
+                    df[col],
+                    lambda value, col=col, suffix=suffix: (f"{col}={value}{suffix}"),
+                )
+            )
+        return ["; ".join(filter(None, parts)) for parts in zip(*column_parts)]
+
+
+class MarkdownRowRenderer(RecordRenderer):
+    """One markdown table row per record under a shared header; empty cells
+    for missing values"""
+
+    name = "markdown"
+
+    def legend(self, df):
+        header = []
+        for col in df.columns:
+            unit = column_unit(self.column_descriptions.get(col, col))
+            header.append(f"{col} [{unit}]" if unit else col)
+        lines = [
+            f"{col}: {self.column_descriptions.get(col, col)}" for col in df.columns
+        ]
+        return (
+            "Columns used in the measurements:\n"
+            + "\n".join(lines)
+            + "\n\n| "
+            + " | ".join(header)
+            + " |\n|"
+            + "---|" * len(header)
+        )
+
+    def render(self, df):
+        column_parts = [build_column_parts(df[col], str) for col in df.columns]
+        return ["| " + " | ".join(parts) + " |" for parts in zip(*column_parts)]
+
+
+RENDERERS = {
+    renderer.name: renderer
+    for renderer in (VerboseRenderer(), KeyValueRenderer(), MarkdownRowRenderer())
+}
+
+
+def benchmark(measurements_path="./ashrae-db-II/measurements.csv", rows=1_000_000):
+    """Check equivalence with the iterrows builder and time both at scale"""
+    df = load_measurements(measurements_path)
+    # Persona-scale input: tile the measurement rows up to the requested size
+    df_large = df.iloc[np.arange(rows) % len(df)].reset_index(drop=True)
+
+    sample = df_large.iloc[:10_000]
+    reference = build_sentences_iterrows(sample, column_descriptions)
+    assert build_sentences(sample, column_descriptions) == reference
+    print(f"Equivalence check passed on {len(sample)} rows")
+
+    start = time.perf_counter()
+    build_sentences_iterrows(sample, column_descriptions)
+    iterrows_rate = len(sample) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    build_sentences(df_large, column_descriptions)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"iterrows builder: {iterrows_rate:,.0f} rows/s (~{rows / iterrows_rate:.1f}s for {rows:,} rows)"
+    )
+    print(
+        f"column builder:   {rows / elapsed:,.0f} rows/s ({elapsed:.1f}s for {rows:,} rows)"
+    )
+
+
+def count_tokens(text):
+    """cl100k token count if tiktoken is installed, else about four characters
+    per token"""
+    if tiktoken is not None:
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    return -(-len(text) // 4)
+
+
+def benchmark_renderers(measurements_path="./ashrae-db-II/measurements.csv", rows=8100):
+    """Prompt-side cost of each record format: tokens per record, tokens of the
+    once-per-prompt legend, and rendering speed. Server throughput and accuracy
+    per format come from running predict.py --record-format <name>."""
+    df = load_measurements(measurements_path, nrows=rows)
+    counter = "tiktoken cl100k" if tiktoken is not None else "~4 chars/token"
+    print(f"Record formats on {len(df)} rows (token counts: {counter})")
+
+    baseline = None
+    for name, renderer in RENDERERS.items():
+        start = time.perf_counter()
+        records = renderer.render(df)
+        elapsed = time.perf_counter() - start
+        record_tokens = np.mean([count_tokens(record) for record in records])
+        legend_tokens = count_tokens(renderer.legend(df))
+        if baseline is None:
+            baseline = record_tokens
+        print(
+            f"{name:>10}: {record_tokens:7.1f} tokens/record "
+            f"({record_tokens / baseline:.2f}x verbose) | legend {legend_tokens} tokens | "
+            f"{len(df) / elapsed:,.0f} rows/s"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark_renderers()
@@ -0,0 +1,253 @@
+import csv
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+# One row per LLM call; times in seconds, empty where not measurable
+FIELDS = [
+    "start",
+    "model",
+    "host",
+    "retry",
+    "status",
+    "stop",
+    "queue_wait",
+    "ttft",
+    "latency",
+    "prompt_tokens",
+    "cached_tokens",
+    "completion_tokens",
+]
+QUANTILES = (0.5, 0.95, 0.99)
+TIMINGS = ("queue_wait", "ttft", "latency")
+
+
+def _format(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return value
+
+
+class RunMetrics:
+    """Per-request telemetry of one evaluation run
+
+    Every call to the LLM server is appended as one CSV row (start offset,
+    model, host, retry number, status, how the completion ended, queue wait
+    for a concurrency slot, time to first token, total latency and token
+    counts, including prompt tokens served from the server's prefix cache
+    where the server reports them). The end-of-run report gives p50/p95/p99 and throughput per
+    model; serve() exposes the same numbers in Prometheus text format.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FIELDS)
+        self._origin = time.monotonic()
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: defaultdict(list))
+        self._requests = defaultdict(Counter)  # (host, status) -> requests
+        self._totals = defaultdict(Counter)  # retries, tokens, completion endings
+        self._server = None
+
+    def record(self, model, host, start, retry=0, status="ok", stop=None, **values):
+        """Log one request; start is its time.monotonic() before queueing
+
+        values may hold queue_wait, ttft, latency, prompt_tokens,
+        cached_tokens and completion_tokens.
+        """
+        row = dict(
+            values,
+            start=start - self._origin,
+            model=model,
+            host=host,
+            retry=retry,
+            status=status,
+            stop=stop,
+        )
+        with self._lock:
+            self._writer.writerow([_format(row.get(field)) for field in FIELDS])
+            samples = self._samples[model]
+            samples["start"].append(row["start"])
+            samples["end"].append(
+                row["start"]
+                + (values.get("queue_wait") or 0.0)
+                + (values.get("latency") or 0.0)
+            )
+            # Failed requests are counted but kept out of the timing percentiles
+            for field in TIMINGS if status == "ok" else ():
+                if values.get(field) is not None:
+                    samples[field].append(values[field])
+            self._requests[model][(host, status)] += 1
+            totals = self._totals[model]
+            totals["retries"] += retry > 0
+            if stop is not None:
+                totals[stop] += 1
+            for field in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                totals[field] += values.get(field) or 0
+            # A stream stopped early never gets its usage chunk, so the token
+            # totals only cover the requests counted here
+            if values.get("prompt_tokens") is not None:
+                totals["usage_reported"] += 1
+            if values.get("cached_tokens") is not None:
+                # Prompt tokens of requests whose server reports cache usage
+                totals["cache_reported"] += 1
+                totals["cache_reported_tokens"] += values.get("prompt_tokens") or 0
+
+    def _quantiles(self, model):
+        samples = self._samples[model]
+        return {
+            field: np.quantile(samples[field], QUANTILES) if samples[field] else None
+            for field in TIMINGS
+        }
+
+    def report(self, model):
+        """Print latency percentiles and throughput for one model"""
+        with self._lock:
+            samples = self._samples[model]
+            if not samples["start"]:
+                return
+            requests = len(samples["start"])
+            span = max(samples["end"]) - min(samples["start"])
+            busy = sum(samples["latency"])
+            quantiles = self._quantiles(model)
+            failed = sum(
+                n for (_, status), n in self._requests[model].items() if status != "ok"
+            )
+            totals = Counter(self._totals[model])
+        print(f"\n=== Request Telemetry ({model}) ===")
+        print(
+            f"   - Requests: {requests} ({failed} failed, {totals['retries']} retries) "
+            f"in {span:.1f}s | {requests / span if span else 0:.2f} requests/s, "
+            f"{totals['completion_tokens'] / span if span else 0:.1f} completion tokens/s"
+        )
+        for field in TIMINGS:
+            if quantiles[field] is not None:
+                p50, p95, p99 = quantiles[field]
+                print(f"   - {field}: p50 {p50:.3f}s | p95 {p95:.3f}s | p99 {p99:.3f}s")
+        print(
+            f"   - Tokens: {totals['prompt_tokens']} prompt, "
+            f"{totals['completion_tokens']} completion, from the "
+            f"{totals['usage_reported']} of {requests} requests that reported usage "
+            f"| Request-seconds (GPU time): {busy:.1f}"
+        )
+        if requests > totals["usage_reported"]:
+            print(
+                f"   - Usage unknown for {requests - totals['usage_reported']} requests "
+                f"(failed, or streams stopped before the final usage chunk)"
+            )
+        if totals["cache_reported_tokens"]:
+            print(
+                f"   - Prefix cache: {totals['cached_tokens']} of "
+                f"{totals['cache_reported_tokens']} prompt tokens cached "
+                f"({totals['cached_tokens'] / totals['cache_reported_tokens']:.1%}) "
+                f"in the {totals['cache_reported']} of {requests} requests that "
+                f"reported it"
+            )
+        stops = [
+            stop for stop in ("answer", "thinking_cap", "finished") if totals[stop]
+        ]
+        if stops:
+            print(
+                "   - Completion ended: "
+                + ", ".join(f"{stop} {totals[stop]}" for stop in stops)
+            )
+
+    def prometheus_text(self):
+        """Current metrics in the Prometheus text exposition format
+
+        Each family has one HELP/TYPE header followed by the samples of
+        every model, told apart by the model label.
+        """
+
+        def family(name, kind, help_text, samples):
+            if samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(samples)
+
+        lines = []
+        with self._lock:
+            models = list(self._samples)
+            quantiles = {model: self._quantiles(model) for model in models}
+            family(
+                "tceval_requests_total",
+                "counter",
+                "Requests by model, host and final status",
+                [
+                    f'tceval_requests_total{{model="{model}",host="{host}",'
+                    f'status="{status}"}} {n}'
+                    for model in models
+                    for (host, status), n in self._requests[model].items()
+                ],
+            )
+            family(
+                "tceval_retries_total",
+                "counter",
+                "Retried attempts",
+                [
+                    f'tceval_retries_total{{model="{model}"}} '
+                    f"{self._totals[model]['retries']}"
+                    for model in models
+                ],
+            )
+            family(
+                "tceval_tokens_total",
+                "counter",
+                "Tokens reported by the server, by kind",
+                [
+                    f'tceval_tokens_total{{model="{model}",kind="{kind}"}} '
+                    f"{self._totals[model][kind + '_tokens']}"
+                    for model in models
+                    for kind in ("prompt", "cached", "completion")
+                ],
+            )
+            for field in TIMINGS:
+                name = f"tceval_{field}_seconds"
+                samples = []
+                for model in models:
+                    if quantiles[model][field] is None:
+                        continue
+                    label = f'model="{model}"'
+                    for q, value in zip(QUANTILES, quantiles[model][field]):
+                        samples.append(f'{name}{{{label},quantile="{q}"}} {value:.6f}')
+                    values = self._samples[model][field]
+                    samples.append(f"{name}_sum{{{label}}} {sum(values):.6f}")
+                    samples.append(f"{name}_count{{{label}}} {len(values)}")
+                family(name, "summary", f"Request {field} in seconds", samples)
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve /metrics for live monitoring from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+        with self._lock:
+            self._file.close()
+        print(f"Request metrics saved to {self.path}")